@@ -0,0 +1,271 @@
+from collections import deque
+from operands import OperatorBinary, OperatorUnary, OperatorFused
+from exceptions import SolverException, OperationExecutionError
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, columns fall back to plain lists
+    np = None
+
+NUMBER_SLOT = None  # stands in for a numeric literal inside a skeleton
+
+
+def split_program(postfix_queue: deque) -> tuple[tuple, list[float]]:
+    """
+    separates a postfix program into its operator skeleton and its numeric literals,
+    two expressions with the same skeleton differ only in their numbers
+    :param postfix_queue: postfix ordered queue filled with operator symbols (str) and values (float)
+    :return: tuple of (skeleton with NUMBER_SLOT in place of every value, list of the values in order)
+    """
+    skeleton = tuple(NUMBER_SLOT if isinstance(token, float) else token for token in postfix_queue)
+    constants = [token for token in postfix_queue if isinstance(token, float)]
+    return skeleton, constants
+
+
+class BatchResult:
+    """
+    results of a batch evaluation, values[i] is None exactly when errors[i] holds the exception of row i
+    """
+    def __init__(self, values: list, errors: list):
+        self.values = values
+        self.errors = errors
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def failed(self) -> list[bool]:
+        """
+        :return: error mask, True for every row that failed
+        """
+        return [error is not None for error in self.errors]
+
+
+class ColumnSolver:
+    """
+    solves a postfix program whose values are whole columns (one entry per row) instead of single floats,
+    every operator is resolved once per program rather than once per row
+    """
+    def __init__(self, operator_registry):
+        self.operator_registry = operator_registry
+
+    def solve_columns(self, program, row_count: int, errors: list = None) -> tuple[list, list]:
+        """
+        goes through the program like the Solver does, but every value on the stack is either a float shared by
+        all rows or a column with a value per row
+        :param program: postfix ordered sequence of operator symbols (str), floats and columns (list or array)
+        :param row_count: amount of rows in every column
+        :param errors: optional errors per row known before solving, those rows are skipped
+        :return: tuple of (values, errors), each a list with an entry per row
+        """
+        if not program:
+            raise SolverException("[ERROR] nothing in operation queue")
+
+        errors = [None] * row_count if errors is None else list(errors)
+        stack = []
+
+        for token in program:
+            if isinstance(token, str):
+                self._handle_operation(token, stack, errors, row_count)
+            else:
+                stack.append(token)
+
+        if len(stack) != 1:
+            raise SolverException("[ERROR] incorrect amount of values in stack")
+
+        result = _as_list(stack.pop(), row_count)
+        values = [None if error is not None else value for value, error in zip(result, errors)]
+        return values, errors
+
+    def _handle_operation(self, symbol: str, stack: list, errors: list, row_count: int):
+        """
+        applies an operator to the top columns of the stack, rows that fail are recorded in errors and skipped
+        by every following operator
+        :param symbol: symbol of operator to be used
+        :param stack: stack with columns or floats
+        :param errors: per row errors so far
+        :param row_count: amount of rows in every column
+        :return: puts the result column back in the stack
+        """
+        operator = self.operator_registry.get_operator(symbol)
+
+        if not isinstance(operator, (OperatorBinary, OperatorUnary, OperatorFused)):
+            raise OperationExecutionError(f"[ERROR] unknown operator type: {type(operator)}")
+        arity = operator.arity
+
+        if len(stack) < arity:
+            raise OperationExecutionError(f"[ERROR] not enough values for operator {symbol}")
+
+        operands = stack[-arity:]
+        del stack[-arity:]
+
+        if operator.pure and all(isinstance(operand, float) for operand in operands):
+            stack.append(_solve_shared(operator, operands, errors))
+        elif np is not None and operator.calculate_array is not None:
+            stack.append(_solve_array(operator, operands, errors, row_count))
+        else:
+            stack.append(_solve_rows(operator, operands, errors, row_count))
+
+
+def _solve_shared(operator, operands: list, errors: list) -> float:
+    """
+    solves an operator whose operands are shared by every row, a failure fails every row still alive
+    """
+    try:
+        return operator.calculate(*operands)
+    except Exception as e:
+        for index, error in enumerate(errors):
+            if error is None:
+                errors[index] = e
+        return 0.0
+
+
+def _solve_array(operator, operands: list, errors: list, row_count: int):
+    """
+    solves an operator for whole columns with its numpy kernel, rows the kernel leaves out are solved one by one
+    """
+    with np.errstate(all="ignore"):
+        result = operator.calculate_array(*(_as_array(operand) for operand in operands))
+
+    if not isinstance(result, tuple):
+        return result
+
+    result, fallback = result
+    fallback = np.flatnonzero(fallback)
+    if not len(fallback):
+        return result
+
+    result = result.tolist()
+    columns = [_as_list(operand, row_count) for operand in operands]
+    for index in fallback.tolist():
+        if errors[index] is not None:
+            continue
+        try:
+            result[index] = operator.calculate(*(column[index] for column in columns))
+        except Exception as e:
+            errors[index] = e
+    return result
+
+
+def _solve_rows(operator, operands: list, errors: list, row_count: int) -> list:
+    """
+    solves an operator row by row, skipping rows that already failed
+    """
+    columns = [_as_list(operand, row_count) for operand in operands]
+    calculate = operator.calculate
+    result = [0.0] * row_count
+
+    if len(columns) == 1:
+        (operand_column,) = columns
+        for index, operand in enumerate(operand_column):
+            if errors[index] is not None:
+                continue
+            try:
+                result[index] = calculate(operand)
+            except Exception as e:
+                errors[index] = e
+    elif len(columns) == 2:
+        left_column, right_column = columns
+        for index, (left_value, right_value) in enumerate(zip(left_column, right_column)):
+            if errors[index] is not None:
+                continue
+            try:
+                result[index] = calculate(left_value, right_value)
+            except Exception as e:
+                errors[index] = e
+    else:
+        for index, row in enumerate(zip(*columns)):
+            if errors[index] is not None:
+                continue
+            try:
+                result[index] = calculate(*row)
+            except Exception as e:
+                errors[index] = e
+
+    return result
+
+
+def _as_list(operand, row_count: int) -> list:
+    if isinstance(operand, float):
+        return [operand] * row_count
+    if np is not None and isinstance(operand, np.ndarray):
+        return operand.tolist()
+    return operand
+
+
+def _as_array(operand):
+    if isinstance(operand, float):
+        return operand
+    return np.asarray(operand, dtype=float)
+
+
+class BatchEvaluator:
+    """
+    evaluates many expressions at once by grouping them on their operator skeleton,
+    each group is then solved a single time with its numbers stacked into columns
+    """
+    def __init__(self, lexer, parser, solver, column_solver: ColumnSolver, optimizer=None):
+        self.lexer = lexer
+        self.parser = parser
+        self.solver = solver
+        self.column_solver = column_solver
+        self.optimizer = optimizer
+
+    def evaluate(self, expressions) -> BatchResult:
+        """
+        evaluates every expression, a failing row doesn't stop the batch, its exception is recorded instead
+        :param expressions: iterable of mathematical expressions as strings
+        :return: BatchResult with a value or an error per expression, in input order
+        """
+        expressions = list(expressions)
+        values = [None] * len(expressions)
+        errors = [None] * len(expressions)
+
+        groups = {}
+        for index, expression in enumerate(expressions):
+            try:
+                postfix_q = self.parser.parse(self.lexer.tokenize(expression))
+            except Exception as e:
+                errors[index] = e
+                continue
+
+            skeleton, constants = split_program(postfix_q)
+            rows, columns = groups.setdefault(skeleton, ([], [[] for _ in constants]))
+            rows.append(index)
+            for column, constant in zip(columns, constants):
+                column.append(constant)
+
+        for skeleton, (rows, columns) in groups.items():
+            self._evaluate_group(skeleton, rows, columns, values, errors)
+
+        return BatchResult(values, errors)
+
+    def _evaluate_group(self, skeleton: tuple, rows: list, columns: list, values: list, errors: list):
+        """
+        solves one skeleton group and scatters its results back to the rows they belong to
+        """
+        if self.optimizer is not None:
+            skeleton = self.optimizer.optimize(skeleton)  # fusing keeps the values in order, so columns still match
+
+        column_iter = iter(columns)
+        program = [next(column_iter) if token is NUMBER_SLOT else token for token in skeleton]
+
+        try:
+            group_values, group_errors = self.column_solver.solve_columns(program, len(rows))
+        except SolverException:
+            # malformed skeleton, let the interpreter report the exact error of every row
+            self._evaluate_rows(skeleton, rows, columns, values, errors)
+            return
+
+        for position, index in enumerate(rows):
+            values[index] = group_values[position]
+            errors[index] = group_errors[position]
+
+    def _evaluate_rows(self, skeleton: tuple, rows: list, columns: list, values: list, errors: list):
+        for position, index in enumerate(rows):
+            column_iter = iter(columns)
+            postfix_q = deque(next(column_iter)[position] if token is NUMBER_SLOT else token for token in skeleton)
+            try:
+                values[index] = self.solver.solve(postfix_q)
+            except Exception as e:
+                errors[index] = e
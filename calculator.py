@@ -1,7 +1,16 @@
+import time
 from operands import *
 from lexer import Lexer
 from parser import Parser
 from solver import Solver
+from batch import BatchEvaluator, BatchResult, ColumnSolver
+from result_store import ResultStore
+from template import Template
+from optimizer import PeepholeOptimizer
+from cost import CostModel
+from tiered import TieredExecutor, DEFAULT_HOT_THRESHOLD, DEFAULT_MAX_HOT_TOKENS
+from specialize import PartialEvaluator, ResidualProgram
+from metrics import CalculationMetrics, describe_postfix, DEFAULT_SLOW_THRESHOLD_NS
 
 LEFT_FACING = "left"
 RIGHT_FACING = "right"
@@ -15,11 +24,26 @@ UNARY_MINUS = 'u-'
 SIGN_MINUS = 's-'
 
 
-def setup_registry() -> OperatorRegistry:
+# results whose estimated cost (see CostModel.scan_expression) is lower are recalculated instead of stored,
+# looking them up costs more than solving them and they'd push the expensive ones out of the store
+DEFAULT_STORE_MIN_COST = 20.0
+
+# most results cached per operator, only expensive pure operators are worth a cache
+MEMO_SIZES = {
+    '!': 1024,
+    '^': 4096,
+    '#': 4096,
+}
+
+
+def setup_registry(memo_sizes: dict = None) -> OperatorRegistry:
     """
     registers all operators to the registry so calculator recognises them
+    :param memo_sizes: dict of symbol to amount of results to cache for it, defaults to MEMO_SIZES
     :return: OperatorRegistry object
     """
+    memo_sizes = MEMO_SIZES if memo_sizes is None else memo_sizes
+
     registry = OperatorRegistry()
 
     registry.register(Add('+', 1))
@@ -44,15 +68,45 @@ def setup_registry() -> OperatorRegistry:
 
     registry.register(UnaryMinus(SIGN_MINUS, 8, LEFT_PLACED))
 
+    for symbol, size in memo_sizes.items():
+        if size:
+            registry.get_operator(symbol).memoize(size)
+
     return registry
 
 
 class Calculator:
-    def __init__(self):
-        self.registry = setup_registry()
+    def __init__(self, result_store: ResultStore = None, optimize: bool = False,
+                 hot_threshold: int = DEFAULT_HOT_THRESHOLD, max_hot_tokens: int = DEFAULT_MAX_HOT_TOKENS,
+                 memo_sizes: dict = None, slow_threshold_ns: int = DEFAULT_SLOW_THRESHOLD_NS,
+                 store_min_cost: float = DEFAULT_STORE_MIN_COST):
+        """
+        :param result_store: optional persistent store, results found there are reused instead of recalculated
+        :param optimize: fuse operator sequences like (a^b)%m before solving, see PeepholeOptimizer
+        :param hot_threshold: calculations of the same expression after which it's compiled, None to never compile
+        :param max_hot_tokens: memory cap of the compiled expressions, in tokens, see TieredExecutor
+        :param memo_sizes: results cached per operator symbol, defaults to MEMO_SIZES
+        :param slow_threshold_ns: calculations taking at least this long are kept in the slow expression log
+        :param store_min_cost: only expressions estimated to cost at least this much go through the result store
+        """
+        self.registry = setup_registry(memo_sizes)
         self.lexer = Lexer(self.registry, BINARY_MINUS, UNARY_MINUS, SIGN_MINUS)
         self.parser = Parser(self.registry)
         self.solver = Solver(self.registry)
+        self.optimizer = PeepholeOptimizer(self.registry) if optimize else None
+        self.column_solver = ColumnSolver(self.registry)
+        self.batch_evaluator = BatchEvaluator(self.lexer, self.parser, self.solver, self.column_solver,
+                                              self.optimizer)
+        self.result_store = result_store
+        self.store_min_cost = store_min_cost
+        self.cost_model = CostModel(self.registry, self.lexer, self.parser)
+        self.metrics = CalculationMetrics(self._describe, slow_threshold_ns)
+        self.partial_evaluator = PartialEvaluator(
+            Lexer(self.registry, BINARY_MINUS, UNARY_MINUS, SIGN_MINUS, allow_placeholders=True), self.parser,
+            self.registry, self.column_solver, self.optimizer
+        )
+        self.tiers = TieredExecutor(self.lexer, self.parser, self.solver, self.registry, self.optimizer,
+                                    hot_threshold, max_hot_tokens, metrics=self.metrics)
 
     def calculate(self, user_input) -> float:
         """
@@ -60,12 +114,146 @@ class Calculator:
         :param user_input: mathematical expression as string
         :return: result as float
         """
+        start = time.perf_counter_ns()
+        error = None
+        use_store = self.result_store is not None and self._worth_storing(user_input)
         try:
-            tokens = self.lexer.tokenize(user_input)
+            if use_store:
+                value = self.result_store.get(self._store_key(), user_input)
+                if value is not None:
+                    return value
 
-            postfix_q = self.parser.parse(tokens)
-
-            result = self.solver.solve(postfix_q)
-            return result
+            result = self.tiers.execute(user_input)
         except Exception as e:
+            error = e
             raise e
+        finally:
+            self.metrics.record_calculation(user_input, time.perf_counter_ns() - start, error)
+
+        if use_store and self._is_storable(user_input):
+            self.result_store.put(self._store_key(), user_input, result)
+        return result
+
+    def _store_key(self) -> str:
+        """
+        :return: key the results of this calculator are stored under, fused operators can give other results
+                 (exact modular powers) than the ones they replace, so optimized results are kept apart
+        """
+        fingerprint = self.registry.fingerprint()
+        return fingerprint + ":fused" if self.optimizer is not None else fingerprint
+
+    def _describe(self, user_input: str) -> dict:
+        """
+        details about an expression for the slow expression log
+        :param user_input: mathematical expression as string
+        :return: dict with the token count, deepest stack of the solver and operators used, None if it doesn't parse
+        """
+        try:
+            tokens = list(self.lexer.tokenize(user_input))
+            max_depth, symbols = describe_postfix(self.parser.parse(tokens), self.registry)
+        except Exception:
+            return {"token_count": None, "max_stack_depth": None, "operators": None}
+        return {"token_count": len(tokens), "max_stack_depth": max_depth, "operators": symbols}
+
+    def dump_metrics(self) -> dict:
+        """
+        :return: latency summary of every stage (lex, parse, solve, total) and the slow expression log
+        """
+        return self.metrics.dump()
+
+    def tier_stats(self) -> dict:
+        """
+        :return: counters of the tiered execution (cold and hot runs, promotions, evictions, hot tier size),
+                 empty if tiering is off
+        """
+        return self.tiers.stats.as_dict() if self.tiers.hot_threshold is not None else {}
+
+    def memo_stats(self) -> dict:
+        """
+        :return: dict of operator symbol to its result cache stats (size, entries, hits, misses, hit rate)
+        """
+        return self.registry.memo_stats()
+
+    def estimate_cost(self, user_input: str) -> float:
+        """
+        estimates how expensive an expression is without solving it, see CostModel
+        :param user_input: mathematical expression as string
+        :return: estimated cost relative to a single addition
+        """
+        return self.cost_model.estimate_expression(user_input)
+
+    def register_operator(self, op: Operator):
+        """
+        adds a user defined operator, it can be used in expressions right away
+        :param op: operator to add, usually a CustomBinary or CustomUnary
+        """
+        self.registry.register_custom(op)
+
+    def _worth_storing(self, expression: str) -> bool:
+        """
+        :param expression: mathematical expression as string
+        :return: whether the expression is expensive enough to look up in the result store and keep there
+        """
+        return self.cost_model.scan_expression(expression) >= self.store_min_cost
+
+    def _is_storable(self, expression: str) -> bool:
+        """
+        :param expression: mathematical expression as string
+        :return: whether the expression only uses pure operators the fingerprint identifies, so its result can be
+                 stored
+        """
+        return not any(symbol in expression for symbol, op in self.registry.operators.items()
+                       if not (op.pure and op.storable))
+
+    def calculate_batch(self, expressions) -> BatchResult:
+        """
+        calculates many expressions at once, expressions sharing the same operator skeleton are solved together
+        :param expressions: iterable of mathematical expressions as strings
+        :return: BatchResult holding a value or the raised exception for every expression, in input order
+        """
+        if self.result_store is None:
+            return self.batch_evaluator.evaluate(expressions)
+
+        expressions = list(expressions)
+        fingerprint = self._store_key()
+        worth_storing = [index for index, expression in enumerate(expressions) if self._worth_storing(expression)]
+        values = [None] * len(expressions)
+        errors = [None] * len(expressions)
+
+        stored = self.result_store.get_many(fingerprint, [expressions[index] for index in worth_storing])
+        for index, value in zip(worth_storing, stored):
+            values[index] = value
+
+        missing = [index for index, value in enumerate(values) if value is None]
+        batch = self.batch_evaluator.evaluate(expressions[index] for index in missing)
+        for index, value, error in zip(missing, batch.values, batch.errors):
+            values[index] = value
+            errors[index] = error
+
+        worth_storing = set(worth_storing)
+        self.result_store.put_many(fingerprint, ((expressions[index], value)
+                                                 for index, value, error in zip(missing, batch.values, batch.errors)
+                                                 if error is None and index in worth_storing
+                                                 and self._is_storable(expressions[index])))
+        return BatchResult(values, errors)
+
+    def compile_template(self, template: str) -> Template:
+        """
+        lexes and parses an expression with {name} placeholders once, so it can be solved for whole columns of values
+        :param template: mathematical expression as string, placeholders stand where numbers would
+        :return: compiled Template
+        """
+        lexer = Lexer(self.registry, BINARY_MINUS, UNARY_MINUS, SIGN_MINUS, allow_placeholders=True)
+        postfix_q = self.parser.parse(lexer.tokenize(template))
+        if self.optimizer is not None:
+            postfix_q = self.optimizer.optimize(postfix_q)
+        return Template(template, postfix_q, self.column_solver)
+
+    def specialize(self, expression: str, bindings: dict) -> ResidualProgram:
+        """
+        fixes some {name} variables of an expression and solves everything that only depends on them once
+        :param expression: mathematical expression with {name} variables where numbers would be
+        :param bindings: dict of variable name to its fixed value
+        :return: ResidualProgram that takes the remaining variables and can be evaluated many times
+        """
+        return self.partial_evaluator.specialize(expression, bindings)
@@ -0,0 +1,68 @@
+import math
+from lexer import Placeholder
+from operands import OperatorRegistry
+
+
+class CompiledProgram:
+    """
+    postfix program turned into one straight-line python function, operators are looked up and the stack is laid
+    out once at compile time, running it calls the same operators in the same order as the Solver would
+    """
+    def __init__(self, function, names: list[str], size: int, source: str):
+        self.function = function
+        self.names = names  # placeholder names, in the order the program takes their values
+        self.size = size  # amount of tokens in the program
+        self.source = source
+
+    def __call__(self, *values: float) -> float:
+        """
+        :param values: value of every placeholder, in the order of names
+        :return: result as float
+        """
+        return self.function(*values)
+
+
+def compile_program(postfix_queue, operator_registry: OperatorRegistry):
+    """
+    compiles a postfix program, placeholders become the parameters of the compiled function
+    :param postfix_queue: postfix ordered queue filled with operator symbols (str), values (float) and placeholders
+    :param operator_registry: registry the operators are looked up in
+    :return: CompiledProgram, None if the program is malformed (the Solver reports those)
+    """
+    names = list(dict.fromkeys(token.name for token in postfix_queue if isinstance(token, Placeholder)))
+    namespace = {}
+    lines = []
+    stack = []
+
+    for token in postfix_queue:
+        if isinstance(token, Placeholder):
+            stack.append(f"p{names.index(token.name)}")
+        elif isinstance(token, float) and math.isfinite(token):
+            stack.append(repr(token))  # repr of a float reads back as exactly the same float
+        elif isinstance(token, float):
+            constant_name = f"c{len(namespace)}"
+            namespace[constant_name] = token
+            stack.append(constant_name)
+        elif isinstance(token, str) and token in operator_registry.operators:
+            operator = operator_registry.get_operator(token)
+            if len(stack) < operator.arity:
+                return None
+
+            function_name = f"f{len(namespace)}"  # names are numbered by namespace size so they never clash
+            namespace[function_name] = operator.calculate
+            operands = ", ".join(stack[-operator.arity:])
+            del stack[-operator.arity:]
+
+            variable = f"v{len(lines)}"
+            lines.append(f"    {variable} = {function_name}({operands})")
+            stack.append(variable)
+        else:
+            return None
+
+    if len(stack) != 1:
+        return None
+
+    parameters = ", ".join(f"p{index}" for index in range(len(names)))
+    source = "\n".join([f"def compiled({parameters}):", *lines, f"    return {stack[0]}"])
+    exec(compile(source, "<compiled expression>", "exec"), namespace)
+    return CompiledProgram(namespace["compiled"], names, len(postfix_queue), source)
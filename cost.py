@@ -0,0 +1,144 @@
+import math
+import re
+from lexer import Placeholder
+from operands import OperatorRegistry, OperatorBinary, RIGHT_PLACED, Factorial, Power, ModularPower, UnaryMinus, Negate
+
+TOKEN_COST = 0.5  # lexing, parsing and pushing one token, relative to an addition
+
+_SCAN_TOKEN = re.compile(r"\d[\d.]*|\S")  # numbers the way the lexer reads them, every other char on its own
+
+
+class CostModel:
+    """
+    estimates how expensive an expression is before solving it, from its tokens, the declared cost of its operators
+    and the size of literal factorial arguments and exponents, only the ratios between estimates mean anything
+    """
+    def __init__(self, operator_registry: OperatorRegistry, lexer, parser):
+        self.operator_registry = operator_registry
+        self.lexer = lexer
+        self.parser = parser
+
+    def estimate_expression(self, expression: str) -> float:
+        """
+        :param expression: mathematical expression as string
+        :return: estimated cost, expressions that don't lex or parse fail fast and only cost their length
+        """
+        try:
+            postfix_q = self.parser.parse(self.lexer.tokenize(expression))
+        except Exception:
+            return TOKEN_COST * max(1, len(expression))
+        return self.estimate(postfix_q)
+
+    def scan_expression(self, expression: str) -> float:
+        """
+        rough estimate from the raw text alone, a fraction of the cost of lexing and parsing, every char counts as a
+        token and every operator its declared cost, scaled by the literals written right next to it (3000!, 2^1000),
+        operands in parentheses are taken as unknown
+        :param expression: mathematical expression as string
+        :return: estimated cost, comparable to estimate_expression for expressions without parentheses
+        """
+        tokens = _SCAN_TOKEN.findall(expression)
+        cost = TOKEN_COST * max(1, len(tokens))
+        operators = self.operator_registry.operators
+
+        for index, token in enumerate(tokens):
+            operator = operators.get(token)
+            if operator is None:
+                continue
+
+            before = _literal(tokens, index - 1)
+            after = _literal(tokens, index + 1)
+            if isinstance(operator, OperatorBinary):
+                operands = [before, after]
+            else:
+                operands = [before if operator.placement_rules == RIGHT_PLACED else after]
+            cost += operator.cost * _scale(operator, operands)
+
+        return cost
+
+    def estimate(self, postfix_queue) -> float:
+        """
+        walks the postfix program like the solver, but only tracks values known without solving
+        (literals and their signs), which is enough to size factorials and powers written with literals
+        :param postfix_queue: postfix ordered queue
+        :return: estimated cost
+        """
+        cost = 0.0
+        known = []  # value of every stack entry, None when it's only known after solving
+
+        for token in postfix_queue:
+            cost += TOKEN_COST
+            if not isinstance(token, str):
+                known.append(None if isinstance(token, Placeholder) else token)
+                continue
+
+            operator = self.operator_registry.operators.get(token)
+            if operator is None or len(known) < operator.arity:
+                break  # malformed, the solver fails on it right away
+
+            operands = known[-operator.arity:]
+            del known[-operator.arity:]
+
+            cost += operator.cost * _scale(operator, operands)
+            known.append(-operands[0] if isinstance(operator, (UnaryMinus, Negate)) and operands[0] is not None
+                         else None)
+
+        return cost
+
+
+def _scale(operator, operands: list) -> float:
+    """
+    how many times the operator's declared cost one calculation with these operands takes
+    """
+    if isinstance(operator, Factorial) and operands[0] is not None:
+        return max(1.0, abs(operands[0]))  # one multiplication per factor
+
+    if isinstance(operator, (Power, ModularPower)) and operands[1] is not None:
+        return math.log2(2 + abs(operands[1]))  # square-and-multiply steps
+
+    return 1.0
+
+
+def _literal(tokens: list[str], index: int):
+    """
+    :return: value of the token at index if it's a number, None otherwise
+    """
+    if 0 <= index < len(tokens) and tokens[index][0].isdigit():
+        try:
+            return float(tokens[index])
+        except ValueError:  # more than one dot, the lexer rejects it
+            return None
+    return None
+
+
+def longest_first(costs: list[float]) -> list[int]:
+    """
+    :param costs: estimated cost of every job
+    :return: indices of the jobs, most expensive first
+    """
+    return sorted(range(len(costs)), key=costs.__getitem__, reverse=True)
+
+
+def split_by_cost(costs: list[float], max_chunk_size: int) -> list[list[int]]:
+    """
+    groups jobs into chunks of roughly equal total cost, expensive jobs end up in small chunks handed out first
+    so no worker is left with a straggler at the end
+    :param costs: estimated cost of every job
+    :param max_chunk_size: most jobs in one chunk
+    :return: chunks of job indices, most expensive chunk first
+    """
+    if not costs:
+        return []
+
+    target = sum(costs) / math.ceil(len(costs) / max_chunk_size)
+    chunks = [[]]
+    chunk_cost = 0.0
+
+    for index in longest_first(costs):
+        if chunks[-1] and (chunk_cost + costs[index] > target or len(chunks[-1]) == max_chunk_size):
+            chunks.append([])
+            chunk_cost = 0.0
+        chunks[-1].append(index)
+        chunk_cost += costs[index]
+
+    return chunks
@@ -0,0 +1,235 @@
+import builtins
+import itertools
+import json
+import queue
+import socket
+import threading
+from collections import deque
+import exceptions
+from calculator import Calculator
+from cost import split_by_cost
+from exceptions import WorkerLostError, RemoteEvaluationError
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_WINDOW_CHUNKS = 16  # chunks scheduled together, cost scheduling balances chunks within a window
+DEFAULT_REPLY_TIMEOUT = 300.0  # seconds a worker may take to answer a chunk before it's taken for dead
+_POLL_INTERVAL = 0.1  # seconds idle connections wait before checking whether the coordinator closed
+
+
+def _send(stream, message: dict):
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+
+def _receive(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def _encode_error(error: Exception) -> dict:
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+def _decode_error(error: dict) -> Exception:
+    """
+    rebuilds the exception a worker reported, as the calculator's own exception type whenever it's a known one
+    """
+    error_type = getattr(exceptions, error["type"], None) or getattr(builtins, error["type"], None)
+    if isinstance(error_type, type) and issubclass(error_type, Exception):
+        try:
+            return error_type(error["message"])
+        except Exception:  # needs more than a message to be built, like UnicodeDecodeError
+            pass
+    return RemoteEvaluationError(f"{error['type']}: {error['message']}")
+
+
+class Coordinator:
+    """
+    hands out chunks of expressions to workers connected over tcp and collects their results,
+    a chunk whose worker disconnects before answering is given to another worker
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, schedule_by_cost: bool = True, calculator=None,
+                 reply_timeout: float = DEFAULT_REPLY_TIMEOUT, window_chunks: int = DEFAULT_WINDOW_CHUNKS):
+        """
+        :param host: interface to listen on
+        :param port: port to listen on, 0 picks a free one (see address)
+        :param chunk_size: most expressions sent to a worker at a time
+        :param max_attempts: times a chunk is handed out before its expressions fail with WorkerLostError
+        :param schedule_by_cost: split batches into chunks of equal estimated cost and hand out the most
+                                 expensive ones first, instead of chunks of consecutive expressions
+        :param calculator: Calculator whose operators the workers use, for the cost estimates
+        :param reply_timeout: seconds a worker may take to answer a chunk, a worker that hangs or whose host drops
+                              off the network without closing the connection is dropped and its chunk retried,
+                              None to wait forever
+        :param window_chunks: chunks worth of expressions scheduled together, the first result of a window can only
+                              be yielded once the chunk holding it is done, which with cost scheduling is usually
+                              one of the last of its window
+        """
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.reply_timeout = reply_timeout
+        self.window_chunks = window_chunks
+        self.cost_model = (calculator or Calculator()).cost_model if schedule_by_cost else None
+        self.retries = 0
+
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()[:2]
+
+        self._chunk_ids = itertools.count()
+        self._chunks = {}  # chunk id -> expressions, until its results were handed out
+        self._attempts = {}
+        self._pending = queue.Queue()
+        self._results = {}
+        self._ready = threading.Condition()
+        self._closed = threading.Event()
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def run(self, expressions):
+        """
+        evaluates the expressions on the connected workers, blocks until workers pick up the work,
+        expressions are read and queued a window (chunk_size * window_chunks of them) at a time and the next window
+        is queued while the current one's results are yielded, so results stream and only two windows are held
+        :param expressions: iterable of mathematical expressions as strings, consumed lazily
+        :return: yields a (value, error) pair per expression, in input order, as soon as it and all before it are done
+        """
+        expressions = iter(expressions)
+        in_flight = deque()
+        while window := list(itertools.islice(expressions, self.chunk_size * self.window_chunks)):
+            in_flight.append(self._submit(window))
+            if len(in_flight) > 1:
+                yield from self._collect(in_flight.popleft())
+
+        while in_flight:
+            yield from self._collect(in_flight.popleft())
+
+    def _submit(self, expressions: list) -> list:
+        """
+        splits a window of expressions into chunks and queues them
+        :return: placement of every expression, its (chunk id, position in chunk)
+        """
+        if self.cost_model is not None:
+            # a text scan, parsing everything here would take about as long as evaluating the cheap rows
+            chunks = split_by_cost([self.cost_model.scan_expression(expression) for expression in expressions],
+                                   self.chunk_size)
+        else:
+            chunks = [list(range(start, min(start + self.chunk_size, len(expressions))))
+                      for start in range(0, len(expressions), self.chunk_size)]
+
+        placement = [None] * len(expressions)
+        for indices in chunks:
+            chunk_id = next(self._chunk_ids)
+            self._chunks[chunk_id] = [expressions[index] for index in indices]
+            self._attempts[chunk_id] = 0
+            for position, index in enumerate(indices):
+                placement[index] = (chunk_id, position)
+            self._pending.put(chunk_id)
+        return placement
+
+    def _collect(self, placement: list):
+        """
+        yields the results of a queued window in input order, waiting for each chunk only when it's first needed
+        """
+        collected = {}  # chunk id -> [results, rows not yielded yet]
+        for chunk_id, position in placement:
+            if chunk_id not in collected:
+                with self._ready:
+                    self._ready.wait_for(lambda: chunk_id in self._results)
+                    results = self._results.pop(chunk_id)
+                collected[chunk_id] = [results, len(results)]
+
+            entry = collected[chunk_id]
+            yield entry[0][position]
+
+            entry[1] -= 1
+            if not entry[1]:
+                del collected[chunk_id]
+                del self._chunks[chunk_id]
+                del self._attempts[chunk_id]
+
+    def close(self):
+        """
+        tells the connected workers to stop and stops accepting new ones
+        """
+        self._closed.set()
+        self.server.close()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection: socket.socket):
+        """
+        feeds one worker a chunk at a time until the coordinator closes or the worker goes away
+        :param connection: socket of the worker
+        """
+        connection.settimeout(self.reply_timeout)  # a timed out send or receive is an OSError, so it's retried
+        with connection, connection.makefile("rwb") as stream:
+            while not self._closed.is_set():
+                try:
+                    chunk_id = self._pending.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+
+                self._attempts[chunk_id] += 1
+                try:
+                    _send(stream, {"chunk": chunk_id, "expressions": self._chunks[chunk_id]})
+                    reply = _receive(stream)
+                    if reply is None or reply.get("chunk") != chunk_id:
+                        raise ConnectionError("worker closed the connection")
+                    results = [(value, None if error is None else _decode_error(error))
+                               for value, error in reply["results"]]
+                    if len(results) != len(self._chunks[chunk_id]):
+                        raise ValueError("worker answered with the wrong amount of results")
+                except Exception:  # whatever went wrong, the chunk must not be lost or run() waits forever
+                    self._retry(chunk_id)
+                    return
+
+                self._complete(chunk_id, results)
+
+            try:
+                _send(stream, {"done": True})
+            except OSError:
+                pass
+
+    def _retry(self, chunk_id: int):
+        if self._attempts[chunk_id] < self.max_attempts:
+            self.retries += 1
+            self._pending.put(chunk_id)
+            return
+
+        error = WorkerLostError(f"[ERROR] chunk {chunk_id} lost its worker {self.max_attempts} times")
+        self._complete(chunk_id, [(None, error)] * len(self._chunks[chunk_id]))
+
+    def _complete(self, chunk_id: int, results: list):
+        with self._ready:
+            self._results[chunk_id] = results
+            self._ready.notify_all()
+
+
+def run_worker(host: str, port: int, calculator=None):
+    """
+    connects to a coordinator and evaluates the chunks it sends until it says it's done
+    :param host: host of the coordinator
+    :param port: port of the coordinator
+    :param calculator: Calculator to evaluate with, a new one if not given
+    """
+    if calculator is None:
+        calculator = Calculator()
+
+    with socket.create_connection((host, port)) as connection, connection.makefile("rwb") as stream:
+        while (message := _receive(stream)) is not None and not message.get("done"):
+            batch = calculator.calculate_batch(message["expressions"])
+            _send(stream, {
+                "chunk": message["chunk"],
+                "results": [(value, None if error is None else _encode_error(error))
+                            for value, error in zip(batch.values, batch.errors)]
+            })
@@ -32,6 +32,10 @@ class PlacementError(LexerError):
     pass
 
 
+class PlaceholderError(LexerError):
+    pass
+
+
 # solvers errors
 class SolverException(Exception):
     pass
@@ -52,3 +56,33 @@ class DivideByZeroException(OperandException):
 
 class OperandNotFoundException(OperandException):
     pass
+
+
+class OperatorRegistrationError(OperandException):
+    pass
+
+
+# templates errors
+class TemplateException(Exception):
+    pass
+
+
+class MissingColumnError(TemplateException):
+    pass
+
+
+# distributed errors
+class DistributedException(Exception):
+    pass
+
+
+class WorkerLostError(DistributedException):
+    pass
+
+
+class RemoteEvaluationError(DistributedException):
+    pass
+
+
+class UnboundVariableError(TemplateException):
+    pass
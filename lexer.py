@@ -1,6 +1,7 @@
 from typing import Generator, Union
 from abc import ABC, abstractmethod
-from exceptions import InvalidNumberError, IllegalCharacterError, UnaryMishandleError, PlacementError
+from exceptions import InvalidNumberError, IllegalCharacterError, UnaryMishandleError, PlacementError, \
+    PlaceholderError
 
 
 class TokenTypes:
@@ -16,6 +17,9 @@ LEFT_PLACED = "left_of_value"
 BINARY = "between_values"
 RIGHT_PLACED = "right_of_value"
 
+PLACEHOLDER_START = '{'
+PLACEHOLDER_END = '}'
+
 L_PARENTHESES = ['(']
 R_PARENTHESES = [')']
 PARENTHESES = L_PARENTHESES + R_PARENTHESES
@@ -149,10 +153,54 @@ class ValueHandler(TokenHandler):
             raise InvalidNumberError(f"[ERROR] failed to read number, invalid number format at index {info.index}")
 
 
+class Placeholder(float):
+    """
+    named value that's only known when the expression is evaluated, it's a float so the parser passes
+    it through to the postfix queue like any other number
+    """
+    def __new__(cls, name: str):
+        placeholder = super().__new__(cls, 0.0)
+        placeholder.name = name
+        return placeholder
+
+    def __repr__(self) -> str:
+        return f"{PLACEHOLDER_START}{self.name}{PLACEHOLDER_END}"
+
+
+class PlaceholderHandler(TokenHandler):
+    def can_handle(self, info: ExpressionInfo) -> bool:
+        """
+        :param info: info object of expression
+        :return: whether current char were on can be handled by this handler
+        """
+        return info.current_char() == PLACEHOLDER_START
+
+    def handle(self, info: ExpressionInfo) -> Generator[Union[str, float], None, None]:
+        """
+        reads a whole {name} placeholder, it's placed like a number
+        :param info: info object of expression
+        :return: Placeholder carrying the name between the braces
+        """
+        start = info.index
+        end = info.expression.find(PLACEHOLDER_END, start)
+        if end == -1:
+            raise PlaceholderError(f"[ERROR] placeholder at index {start} is never closed")
+
+        name = info.expression[start + 1:end]
+        if not name or not all(char.isalnum() or char == "_" for char in name):
+            raise PlaceholderError(f"[ERROR] invalid placeholder name {name!r} at index {start}")
+        if info.prev_token in [TokenTypes.NUMBER, TokenTypes.R_PAREN]:
+            raise PlacementError(f"[ERROR] placeholder {name} placed in incorrect location {start}")
+
+        info.prev_token = TokenTypes.NUMBER
+        info.next(end - start + 1)
+        yield Placeholder(name)
+
+
 class OperatorHandler(TokenHandler):
     def __init__(self, operator_registry):
         self.operator_registry = operator_registry
-        self.operators = operator_registry.get_all_operands()
+        self.operators = operator_registry.operators  # live view, operators registered later are recognised too
 
     def can_handle(self, info: ExpressionInfo) -> bool:
         """
@@ -213,12 +261,15 @@ class OperatorHandler(TokenHandler):
 
 
 class Lexer:
-    def __init__(self, operator_registry, binary_minus: str, unary_minus: str, sign_minus: str):
+    def __init__(self, operator_registry, binary_minus: str, unary_minus: str, sign_minus: str,
+                 allow_placeholders: bool = False):
         self.handlers = [
             MinusHandler(binary_minus, unary_minus, sign_minus),
             ValueHandler(),
             OperatorHandler(operator_registry)
         ]
+        if allow_placeholders:
+            self.handlers.append(PlaceholderHandler())
 
     def tokenize(self, expression: str) -> Generator[Union[str, float], None, None]:
         """
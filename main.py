@@ -1,7 +1,42 @@
+import argparse
 from calculator import Calculator
+from watcher import ExpressionFileWatcher
+from distributed import run_worker
+
+
+def watch(paths: list[str], interval: float):
+    """
+    keeps the sidecar results of the given expression files up to date until interrupted
+    :param paths: expression files, one expression per line
+    :param interval: seconds between checks for changes
+    """
+    def report(evaluated: dict[str, int]):
+        for path, count in evaluated.items():
+            print(f"{path}: recalculated {count} line(s)")
+
+    watcher = ExpressionFileWatcher(Calculator(), paths)
+    print(f"Watching {', '.join(paths)}, press Ctrl+C to stop")
+    watcher.watch(interval, report)
 
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="Powerful calculator that can calculate using all sorts of operators")
+    arg_parser.add_argument("--watch", nargs="+", metavar="FILE",
+                            help="watch expression files and write their results to FILE.out on every change")
+    arg_parser.add_argument("--interval", type=float, default=0.5, help="seconds between checks in watch mode")
+    arg_parser.add_argument("--worker", metavar="HOST:PORT",
+                            help="evaluate expressions sent by a distributed.Coordinator listening on HOST:PORT")
+    args = arg_parser.parse_args()
+
+    if args.watch:
+        watch(args.watch, args.interval)
+        return
+
+    if args.worker:
+        host, _, port = args.worker.rpartition(":")
+        run_worker(host, int(port))
+        return
+
     print("""                                                
   ____                        _____     __         __     __          
  ╱ __ ╲__ _  ___ ___ ____ _  ╱ ___╱__ _╱ ╱_____ __╱ ╱__ _╱ ╱____  ____
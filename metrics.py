@@ -0,0 +1,154 @@
+import time
+from collections import deque
+
+SUB_BUCKET_BITS = 4  # 16 buckets per power of two, every bucket is within ~6% of the values it holds
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_BUCKET_COUNT = 64 * _SUB_BUCKETS  # enough for any 64 bit duration in nanoseconds
+
+STAGES = ("lex", "parse", "solve", "total")
+DEFAULT_SLOW_THRESHOLD_NS = 10_000_000  # 10ms
+DEFAULT_SLOW_LOG_SIZE = 256
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket_index(value: int) -> int:
+    """
+    log-linear bucket of a value: exact below 2 * _SUB_BUCKETS, then _SUB_BUCKETS buckets per power of two
+    """
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return value
+    return shift * _SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < 2 * _SUB_BUCKETS:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    return ((index - shift * _SUB_BUCKETS + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    fixed size hdr style histogram of durations in nanoseconds, recording is a couple of integer operations
+    """
+    def __init__(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int):
+        """
+        :param value: duration in nanoseconds
+        """
+        self.counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        """
+        :param percentile: between 0 and 100
+        :return: upper bound of the bucket holding the percentile, in nanoseconds, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+
+        rank = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(_bucket_upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        summary = {"count": self.count, "min_ns": self.min or 0, "max_ns": self.max or 0,
+                   "mean_ns": self.total / self.count if self.count else 0.0}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile:g}_ns"] = self.percentile(percentile)
+        return summary
+
+
+def describe_postfix(postfix_queue, operator_registry) -> tuple[int, list[str]]:
+    """
+    :param postfix_queue: postfix ordered queue
+    :param operator_registry: registry the operators are looked up in
+    :return: tuple of (deepest the solver's stack gets, symbols of the operators used)
+    """
+    depth = 0
+    max_depth = 0
+    symbols = []
+    for token in postfix_queue:
+        if isinstance(token, str) and token in operator_registry.operators:
+            depth -= operator_registry.get_operator(token).arity - 1
+            if token not in symbols:
+                symbols.append(token)
+        else:
+            depth += 1
+            max_depth = max(max_depth, depth)
+    return max_depth, symbols
+
+
+class SlowExpressionLog:
+    """
+    ring buffer of the latest calculations that took longer than a threshold
+    """
+    def __init__(self, threshold_ns: int = DEFAULT_SLOW_THRESHOLD_NS, size: int = DEFAULT_SLOW_LOG_SIZE):
+        self.threshold_ns = threshold_ns
+        self.entries = deque(maxlen=size)
+
+    def record(self, entry: dict):
+        self.entries.append(entry)
+
+    def dump(self) -> list[dict]:
+        return list(self.entries)
+
+
+class CalculationMetrics:
+    """
+    always on latency histograms of every calculation stage plus the slow expression log,
+    describe is called with an expression that was slow and returns details about it for the log
+    """
+    def __init__(self, describe, slow_threshold_ns: int = DEFAULT_SLOW_THRESHOLD_NS,
+                 slow_log_size: int = DEFAULT_SLOW_LOG_SIZE):
+        self.describe = describe
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.slow_log = SlowExpressionLog(slow_threshold_ns, slow_log_size)
+        self._stages = {}
+
+    def record_stage(self, stage: str, duration: int):
+        """
+        :param stage: one of STAGES except total
+        :param duration: nanoseconds the stage took
+        """
+        self.histograms[stage].record(duration)
+        self._stages[stage] = duration
+
+    def record_calculation(self, expression: str, duration: int, error: Exception = None):
+        """
+        records the total duration of a calculation and logs it if it was slow
+        :param expression: the expression that was calculated
+        :param duration: nanoseconds the whole calculation took
+        :param error: exception it failed with, if it failed
+        """
+        self.histograms["total"].record(duration)
+        stages, self._stages = self._stages, {}
+
+        if duration >= self.slow_log.threshold_ns:
+            entry = {"expression": expression, "time": time.time(), "total_ns": duration, "stages_ns": stages,
+                     "error": None if error is None else str(error)}
+            entry.update(self.describe(expression))
+            self.slow_log.record(entry)
+
+    def dump(self) -> dict:
+        """
+        :return: dict with the summary of every stage's histogram and the slow expression log
+        """
+        return {"histograms": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                "slow_expressions": self.slow_log.dump()}
@@ -1,6 +1,16 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
 import math
-from exceptions import OperandException, DivideByZeroException, OperandNotFoundException
+from decimal import Decimal
+from functools import lru_cache, partial, reduce
+from types import MethodType, ModuleType
+from exceptions import OperandException, DivideByZeroException, OperandNotFoundException, OperatorRegistrationError
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only the array kernels need it
+    np = None
 
 LEFT_FACING = "left"
 RIGHT_FACING = "right"
@@ -8,6 +18,16 @@ RIGHT_FACING = "right"
 LEFT_PLACED = "left_of_value"
 BINARY = "between_values"
 RIGHT_PLACED = "right_of_value"
+FUSED = "fused"  # placement of operators the optimizer builds, they never appear in typed expressions
+
+RESERVED_SYMBOLS = ['-', '.', '(', ')', '{', '}']  # read by the lexer itself
+
+_DIGIT_CHUNK = 10 ** 4  # integers are taken apart 4 digits at a time using the lookup table below
+_CHUNK_DIGIT_SUMS = [0] * _DIGIT_CHUNK
+for _chunk in range(1, _DIGIT_CHUNK):
+    _CHUNK_DIGIT_SUMS[_chunk] = _CHUNK_DIGIT_SUMS[_chunk // 10] + _chunk % 10
+_SPLIT_BITS = 4096  # above this size integers are halved first, repeated divmod by a small chunk is quadratic
+_MAX_EXACT_FLOAT = 2 ** 53
 
 
 class Operator(ABC):
@@ -17,12 +37,99 @@ class Operator(ABC):
         self.direction = direction
         self.placement_rules = placement_rules
 
+    # bumped whenever an operator's results change so stored results of the old behaviour are not reused
+    version = 1
+
+    # pure operators always give the same result for the same operands, so their results may be cached and folded
+    pure = True
+
+    # relative cost of one calculation, an addition costs 1
+    cost = 1.0
+
+    # optional exact implementation taking and returning ints, used for whole number operands
+    calculate_exact = None
+
+    # optional element-wise numpy kernel taking arrays (or floats) and returning an array, it may instead return
+    # (array, mask) where mask marks rows the kernel can't handle and that go through calculate one by one,
+    # rows that would raise must never be solved by the kernel itself
+    calculate_array = None
+
+    # whether results may be kept in a ResultStore, False when the fingerprint can't tell this operator's
+    # behaviour apart from another one's
+    storable = True
+
+    # cache of results when memoize was called, see OperatorMemo
+    memo = None
+
     @abstractmethod
     def calculate(self, *args) -> float:
         pass
 
+    def memoize(self, size: int) -> "Operator":
+        """
+        caches up to size results of this operator, keyed on the operands, only allowed for pure operators
+        :param size: most results kept, the least recently used are dropped first
+        :return: the operator itself so it can be registered right away
+        """
+        if not self.pure:
+            raise OperandException(f"[ERROR] operator {self.symbol} isn't pure, its results can't be cached")
+        self.memo = OperatorMemo(size)
+        self.calculate = self.memo.wrap(type(self).calculate.__get__(self))
+        return self
+
+
+class OperatorMemo:
+    """
+    bounded least recently used cache of one operator's results, with hit counters
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def wrap(self, calculate):
+        """
+        :param calculate: the operator's own calculate
+        :return: calculate answering from the cache whenever it can, failures are never cached
+        """
+        results = self._results
+
+        def memoized(*operands: float) -> float:
+            if 0.0 in operands:
+                key = tuple((operand, math.copysign(1.0, operand)) for operand in operands)  # tells 0.0 from -0.0
+            elif any(operand != operand for operand in operands):
+                return calculate(*operands)  # nan is never equal to itself, it can't be looked up
+            else:
+                key = operands
+
+            result = results.get(key)
+            if result is not None:
+                self.hits += 1
+                results.move_to_end(key)
+                return result
+
+            self.misses += 1
+            result = calculate(*operands)
+            results[key] = result
+            if len(results) > self.size:
+                results.popitem(last=False)
+            return result
+
+        return memoized
+
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def stats(self) -> dict:
+        return {"size": self.size, "entries": len(self._results), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate()}
+
 
 class OperatorBinary(Operator):
+    arity = 2
+
     def __init__(self, symbol: str, intensity: int, direction: str = LEFT_FACING):
         super().__init__(symbol, intensity, direction, BINARY)  # all go left-to-right according to instructions
 
@@ -41,6 +148,9 @@ class Add(OperatorBinary):
         """
         return operand1 + operand2
 
+    def calculate_array(self, operand1, operand2):
+        return operand1 + operand2
+
 
 class Subtract(OperatorBinary):
     def calculate(self, operand1: float, operand2: float) -> float:
@@ -52,8 +162,13 @@ class Subtract(OperatorBinary):
         """
         return operand1 - operand2
 
+    def calculate_array(self, operand1, operand2):
+        return operand1 - operand2
+
 
 class Divide(OperatorBinary):
+    cost = 1.5
+
     def calculate(self, operand1: float, operand2: float) -> float:
         """
         returns operand 1 divided by operand 2
@@ -76,8 +191,13 @@ class Multiply(OperatorBinary):
         """
         return operand1 * operand2
 
+    def calculate_array(self, operand1, operand2):
+        return operand1 * operand2
+
 
 class Power(OperatorBinary):
+    cost = 4.0
+
     def calculate(self, operand1: float, operand2: float) -> float:
         """
         returns operand 1 to the power of operand 2
@@ -89,6 +209,8 @@ class Power(OperatorBinary):
 
 
 class Modulo(OperatorBinary):
+    cost = 1.5
+
     def calculate(self, operand1: float, operand2: float) -> float:
         """
         returns operand 1 modulo operand 2
@@ -109,6 +231,9 @@ class Maximum(OperatorBinary):
         """
         return operand1 if operand1 >= operand2 else operand2
 
+    def calculate_array(self, operand1, operand2):
+        return np.where(operand1 >= operand2, operand1, operand2)
+
 
 class Minimum(OperatorBinary):
     def calculate(self, operand1: float, operand2: float) -> float:
@@ -120,6 +245,9 @@ class Minimum(OperatorBinary):
         """
         return operand1 if operand1 <= operand2 else operand2
 
+    def calculate_array(self, operand1, operand2):
+        return np.where(operand1 <= operand2, operand1, operand2)
+
 
 class Average(OperatorBinary):
     def calculate(self, operand1: float, operand2: float) -> float:
@@ -131,8 +259,13 @@ class Average(OperatorBinary):
         """
         return (operand1 + operand2) / 2
 
+    def calculate_array(self, operand1, operand2):
+        return (operand1 + operand2) / 2
+
 
 class OperatorUnary(Operator):
+    arity = 1
+
     def __init__(self, symbol: str, intensity: int, placement: str, direction: str = RIGHT_FACING):
         super().__init__(symbol, intensity, direction, placement)  # all go left-to-right according to instructions
 
@@ -150,6 +283,9 @@ class UnaryMinus(OperatorUnary):
         """
         return -operand
 
+    def calculate_array(self, operand):
+        return -operand
+
 
 class Negate(OperatorUnary):
     def calculate(self, operand: float) -> float:
@@ -160,8 +296,13 @@ class Negate(OperatorUnary):
         """
         return -operand
 
+    def calculate_array(self, operand):
+        return -operand
+
 
 class Factorial(OperatorUnary):
+    cost = 10.0
+
     def calculate(self, operand: float) -> float:
         """
         calculates the factorial of operand
@@ -170,27 +311,306 @@ class Factorial(OperatorUnary):
         """
         if operand < 0 or not operand.is_integer():
             raise OperandException("[ERROR] factorial only defined for positive whole numbers i.e integers")
-        result = 1
-        for i in range(1, int(operand) + 1):
-            result *= i
-        return float(result)
+        return float(math.factorial(int(operand)))
 
 
 class DigitSum(OperatorUnary):
+    version = 3  # digits of the shortest representation above 2^53, 2 used the exact value's float noise digits
+    cost = 3.0
+
+    def calculate(self, operand: float) -> float:
+        """
+        sums all the digits in the operand, as written in its shortest decimal representation without exponent
+        digits, 1e23# is 1 even though the float is stored as 100000000000000008388608,
+        whole numbers below 2^53 are exact integers and skip building the representation
+        :param operand: float to work with
+        :return: result as float
+        """
+        if not math.isfinite(operand):
+            raise OperandException("[ERROR] digit sum only defined for finite numbers")
+        if operand.is_integer() and abs(operand) < _MAX_EXACT_FLOAT:
+            return float(digit_sum_int(int(operand)))
+        return float(sum(Decimal(repr(operand)).as_tuple().digits))
+
+    def calculate_array(self, operand):
+        return digit_sum_array(operand)
+
+
+def digit_sum_int(value: int) -> int:
+    """
+    sums the decimal digits of an integer without converting it to a string
+    :param value: int to work with, the sign is ignored
+    :return: sum of digits as int
+    """
+    value = abs(value)
+
+    if value.bit_length() > _SPLIT_BITS:
+        half = int(value.bit_length() * math.log10(2)) // 2
+        high, low = divmod(value, _power_of_ten(half))
+        return digit_sum_int(high) + digit_sum_int(low)
+
+    total = 0
+    while value:
+        value, chunk = divmod(value, _DIGIT_CHUNK)
+        total += _CHUNK_DIGIT_SUMS[chunk]
+    return total
+
+
+@lru_cache(maxsize=64)
+def _power_of_ten(exponent: int) -> int:
+    return 10 ** exponent
+
+
+def digit_sum_array(values):
+    """
+    numpy kernel of the digit sum for whole numbers below 2^53, other rows are left for DigitSum.calculate
+    :param values: array of floats
+    :return: tuple of (array of digit sums, mask of rows that weren't handled)
+    """
+    values = np.abs(np.asarray(values, dtype=float))
+    handled = np.isfinite(values) & (values == np.floor(values)) & (values < _MAX_EXACT_FLOAT)
+
+    remaining = np.where(handled, values, 0).astype(np.int64)
+    table = np.array(_CHUNK_DIGIT_SUMS, dtype=np.int64)
+    totals = np.zeros(remaining.shape, dtype=np.int64)
+    while remaining.any():
+        remaining, chunks = np.divmod(remaining, _DIGIT_CHUNK)
+        totals += table[chunks]
+
+    return totals.astype(float), ~handled
+
+
+_STABLE_TYPES = (int, float, complex, str, bytes, bool, type(None), tuple, frozenset)
+
+
+def function_digest(function, _seen: set = None):
+    """
+    digest of what a function does rather than what it's called (every lambda is called <lambda>),
+    made from its bytecode, constants, referenced names, defaults and the values it closes over,
+    partials and bound methods add what they're bound to, builtins are known by name
+    :param function: callable to describe
+    :return: short hex digest, the same in every process for the same source,
+             None if it depends on state that can't be described (mutable values, objects)
+    """
+    seen = set() if _seen is None else _seen
+    if id(function) in seen:  # recursive closures refer back to themselves
+        return "recursive"
+    seen.add(id(function))
+
+    digest = hashlib.sha256()
+    code = getattr(function, "__code__", None)
+    if code is not None:
+        _hash_code(code, digest)
+        captured = list(function.__defaults__ or ()) + list((function.__kwdefaults__ or {}).items())
+        for cell in function.__closure__ or ():
+            try:
+                captured.append(cell.cell_contents)
+            except ValueError:  # cell not filled yet
+                captured.append(None)
+    elif isinstance(function, partial):
+        captured = [function.func, *function.args, *sorted(function.keywords.items())]
+    elif isinstance(function, MethodType):
+        captured = [function.__func__, function.__self__]
+    elif getattr(type(function).__call__, "__code__", None) is not None:  # instance of a class with __call__
+        captured = [type(function).__call__, *sorted(getattr(function, "__dict__", {}).items())]
+    else:  # builtins and other callables without bytecode
+        owner = getattr(function, "__self__", None)
+        if owner is not None and not isinstance(owner, ModuleType):  # method of a builtin object, like [].append
+            return None
+        name = getattr(function, "__qualname__", None) or getattr(function, "__name__", type(function).__qualname__)
+        return f"{getattr(function, '__module__', None)}.{name}"
+
+    for value in captured:
+        description = _describe_value(value, seen)
+        if description is None:
+            return None
+        digest.update(description.encode())
+
+    return digest.hexdigest()[:16]
+
+
+def _describe_value(value, seen: set):
+    if isinstance(value, tuple):
+        descriptions = [_describe_value(item, seen) for item in value]
+        return None if None in descriptions else repr(descriptions)
+    if isinstance(value, _STABLE_TYPES):
+        return repr(value)
+    if callable(value):
+        return function_digest(value, seen)
+    return None  # mutable state, it can change while the function is in use
+
+
+def _hash_code(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, type(code)):  # nested functions, their repr holds a memory address
+            _hash_code(constant, digest)
+        else:
+            digest.update(repr(constant).encode())
+
+
+def _custom_version(version: int, *functions) -> tuple[tuple, bool]:
+    """
+    :param version: version given by the user
+    :param functions: every function the operator may call, None for the ones it doesn't have
+    :return: tuple of (version including a digest of every function, whether all of them could be described)
+    """
+    digests = tuple("" if function is None else function_digest(function) for function in functions)
+    return (version, *digests), None not in digests
+
+
+class CustomBinary(OperatorBinary):
+    """
+    binary operator defined by plain functions instead of a subclass, see OperatorRegistry.register_custom
+    """
+    def __init__(self, symbol: str, intensity: int, function, direction: str = LEFT_FACING, pure: bool = True,
+                 cost: float = 1.0, array_function=None, exact_function=None, version: int = 1):
+        """
+        :param symbol: single character written between the two values
+        :param intensity: precedence, higher binds tighter (+ is 1, ^ is 4, ! is 7)
+        :param function: takes two floats and returns the result
+        :param direction: LEFT_FACING to solve chains left-to-right, RIGHT_FACING for right-to-left
+        :param pure: whether the same operands always give the same result, only pure results are cached or folded
+        :param cost: relative cost of one calculation, an addition costs 1
+        :param array_function: optional numpy kernel, see Operator.calculate_array
+        :param exact_function: optional function taking and returning ints, used when both operands are whole
+        :param version: bump it when the function's results change so stored results aren't reused
+        """
+        super().__init__(symbol, intensity, direction)
+        self.function = function
+        self.pure = pure
+        self.cost = cost
+        self.calculate_array = array_function
+        self.calculate_exact = exact_function
+        self.version, self.storable = _custom_version(version, function, array_function, exact_function)
+
+    def calculate(self, operand1: float, operand2: float) -> float:
+        """
+        calls the exact function for whole operands when there is one, the float function otherwise
+        :param operand1: float to work with
+        :param operand2: second float to work with
+        :return: result as float
+        """
+        if self.calculate_exact is not None and operand1.is_integer() and operand2.is_integer():
+            return float(self.calculate_exact(int(operand1), int(operand2)))
+        return float(self.function(operand1, operand2))
+
+
+class CustomUnary(OperatorUnary):
+    """
+    unary operator defined by plain functions instead of a subclass, see OperatorRegistry.register_custom
+    """
+    def __init__(self, symbol: str, intensity: int, placement: str, function, pure: bool = True, cost: float = 1.0,
+                 array_function=None, exact_function=None, version: int = 1):
+        """
+        :param symbol: single character written next to the value
+        :param intensity: precedence, higher binds tighter (+ is 1, ^ is 4, ! is 7)
+        :param placement: LEFT_PLACED if it's written before the value (like ~), RIGHT_PLACED if after (like !)
+        :param function: takes a float and returns the result
+        :param pure: whether the same operand always gives the same result, only pure results are cached or folded
+        :param cost: relative cost of one calculation, an addition costs 1
+        :param array_function: optional numpy kernel, see Operator.calculate_array
+        :param exact_function: optional function taking and returning an int, used when the operand is whole
+        :param version: bump it when the function's results change so stored results aren't reused
+        """
+        super().__init__(symbol, intensity, placement)
+        self.function = function
+        self.pure = pure
+        self.cost = cost
+        self.calculate_array = array_function
+        self.calculate_exact = exact_function
+        self.version, self.storable = _custom_version(version, function, array_function, exact_function)
+
     def calculate(self, operand: float) -> float:
         """
-        sums all the digits in the operand
+        calls the exact function for a whole operand when there is one, the float function otherwise
         :param operand: float to work with
         :return: result as float
         """
-        num_str = str(operand)
+        if self.calculate_exact is not None and operand.is_integer():
+            return float(self.calculate_exact(int(operand)))
+        return float(self.function(operand))
+
+
+class OperatorFused(Operator):
+    """
+    operator standing in for a sequence of operators, built by the optimizer and taking arity operands at once
+    """
+    def __init__(self, symbol: str, arity: int):
+        super().__init__(symbol, 0, LEFT_FACING, FUSED)
+        self.arity = arity
+
+    @abstractmethod
+    def calculate(self, *operands: float) -> float:
+        pass
+
+
+class ModularPower(OperatorFused):
+    cost = 4.0
+
+    def __init__(self, symbol: str, power: Operator, modulo: Operator):
+        super().__init__(symbol, 3)
+        self.power = power
+        self.modulo = modulo
+
+    def calculate(self, base: float, exponent: float, modulus: float) -> float:
+        """
+        (base ^ exponent) % modulus, whole numbers use modular exponentiation so the power is never built
+        :param base: float to work with
+        :param exponent: second float to work with
+        :param modulus: third float to work with
+        :return: result as float
+        """
+        if base.is_integer() and exponent.is_integer() and exponent >= 0 and modulus.is_integer() and modulus != 0:
+            return float(pow(int(base), int(exponent), int(modulus)))
+        return self.modulo.calculate(self.power.calculate(base, exponent), modulus)
 
-        total = 0
-        for char in num_str:
-            if char.isdigit():
-                total += int(char)
 
-        return float(total)
+class MultiplyAdd(OperatorFused):
+    def __init__(self, symbol: str):
+        super().__init__(symbol, 3)
+
+    def calculate(self, operand1: float, operand2: float, operand3: float) -> float:
+        """
+        returns operand 1 multiplied by operand 2 plus operand 3, rounded after each step like the separate operators
+        :param operand1: float to work with
+        :param operand2: second float to work with
+        :param operand3: third float to work with
+        :return: result as float
+        """
+        return operand1 * operand2 + operand3
+
+    def calculate_array(self, operand1, operand2, operand3):
+        return operand1 * operand2 + operand3
+
+
+class Reduction(OperatorFused):
+    def __init__(self, symbol: str, operator: OperatorBinary, arity: int):
+        super().__init__(symbol, arity)
+        self.operator = operator
+        if operator.calculate_array is None:
+            self.calculate_array = None  # nothing to fold, columns are solved row by row
+
+    def calculate(self, *operands: float) -> float:
+        """
+        applies the binary operator to all operands from left to right, the same as a chain of it
+        :param operands: floats to work with
+        :return: result as float
+        """
+        return reduce(self.operator.calculate, operands)
+
+    def calculate_array(self, *operands):
+        """
+        folds the operator's numpy kernel over the operands, rows any step leaves out are left for calculate
+        """
+        result, fallback = operands[0], None
+        for operand in operands[1:]:
+            result = self.operator.calculate_array(result, operand)
+            if isinstance(result, tuple):
+                result, step_fallback = result
+                fallback = step_fallback if fallback is None else fallback | step_fallback
+        return result if fallback is None else (result, fallback)
 
 
 class OperatorRegistry:
@@ -199,6 +619,7 @@ class OperatorRegistry:
     """
     def __init__(self):
         self.operators = {}
+        self._fingerprint = None
 
     def register(self, op: Operator):
         """
@@ -206,6 +627,23 @@ class OperatorRegistry:
         :param op: operand to store
         """
         self.operators[op.symbol] = op
+        self._fingerprint = None
+
+    def register_custom(self, op: Operator):
+        """
+        stores a user defined operand after checking the lexer will be able to read it
+        :param op: operand to store, usually a CustomBinary or CustomUnary
+        """
+        if not isinstance(op, (OperatorBinary, OperatorUnary)):
+            raise OperatorRegistrationError(f"[ERROR] custom operators must be unary or binary, got {type(op)}")
+        if len(op.symbol) != 1 or op.symbol.isdigit() or op.symbol.isspace() or op.symbol in RESERVED_SYMBOLS:
+            raise OperatorRegistrationError(f"[ERROR] {op.symbol!r} can't be used as an operator symbol")
+        if op.symbol in self.operators:
+            raise OperatorRegistrationError(f"[ERROR] operator {op.symbol} is already registered")
+        if isinstance(op, OperatorUnary) and op.placement_rules not in [LEFT_PLACED, RIGHT_PLACED]:
+            raise OperatorRegistrationError(f"[ERROR] unary operator {op.symbol} must be placed left or right of values")
+
+        self.register(op)
 
     def get_operator(self, symbol: str) -> Operator:
         """
@@ -217,6 +655,30 @@ class OperatorRegistry:
             raise OperandNotFoundException(f"[ERROR] unknown operator: {symbol}")
         return self.operators[symbol]
 
+    def fingerprint(self) -> str:
+        """
+        describes the registered operators and their behaviour versions, two registries with the same fingerprint
+        solve every expression the same way
+        :return: short hex digest
+        """
+        if self._fingerprint is not None:
+            return self._fingerprint
+
+        description = sorted(
+            (symbol, type(op).__module__, type(op).__qualname__, op.version, op.intensity, op.direction,
+             op.placement_rules)
+            for symbol, op in self.operators.items()
+            if not isinstance(op, OperatorFused)  # fused operators are built from the others
+        )
+        self._fingerprint = hashlib.sha256(repr(description).encode()).hexdigest()[:16]
+        return self._fingerprint
+
+    def memo_stats(self) -> dict:
+        """
+        :return: dict of symbol to cache stats for every memoized operator
+        """
+        return {symbol: op.memo.stats() for symbol, op in self.operators.items() if op.memo is not None}
+
     def get_all_operands(self) -> list[str]:
         """
         returns a list of all the symbols of the operands in the registry
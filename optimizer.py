@@ -0,0 +1,124 @@
+from collections import deque
+from operands import Add, Multiply, Power, Modulo, Maximum, Minimum, Average, ModularPower, MultiplyAdd, Reduction, \
+    OperatorRegistry
+
+MODULAR_POWER = '^%'
+MULTIPLY_ADD = '*+'
+
+REDUCIBLE = (Maximum, Minimum, Average)
+
+
+class Node:
+    """
+    expression tree node, leaves hold a value (anything but a str) and operators hold their symbol
+    """
+    def __init__(self, token, children: tuple = ()):
+        self.token = token
+        self.children = children
+
+
+def build_tree(postfix_queue, operator_registry: OperatorRegistry, rewrite=None):
+    """
+    turns a postfix program into an expression tree without recursion so very long expressions are fine
+    :param postfix_queue: postfix ordered tokens, operators as str and values as anything else
+    :param operator_registry: registry the operators are looked up in
+    :param rewrite: optional function called on every operator node once its children are built,
+                    returns the node to use instead
+    :return: root Node, None if the program is malformed (the solver reports those)
+    """
+    stack = []
+    for token in postfix_queue:
+        if not isinstance(token, str):
+            stack.append(Node(token))
+            continue
+
+        if token not in operator_registry.operators:
+            return None
+        arity = operator_registry.get_operator(token).arity
+        if len(stack) < arity:
+            return None
+
+        node = Node(token, tuple(stack[-arity:]))
+        del stack[-arity:]
+        stack.append(rewrite(node) if rewrite is not None else node)
+
+    if len(stack) != 1:
+        return None
+    return stack[0]
+
+
+def flatten(root: Node) -> deque:
+    """
+    turns an expression tree back into a postfix program
+    :param root: root of the tree
+    :return: postfix ordered queue
+    """
+    output = deque()
+    pending = [(root, False)]
+    while pending:
+        node, children_done = pending.pop()
+        if children_done or not node.children:
+            output.append(node.token)
+            continue
+        pending.append((node, True))
+        pending.extend((child, False) for child in reversed(node.children))
+    return output
+
+
+class PeepholeOptimizer:
+    """
+    replaces operator sequences in postfix programs with fused operators that solve them in one step:
+    (a^b)%m -> modular power, a*b+c -> multiply-add, a$b$c... -> one reduction (same for & and @)
+    operands keep their order, so every rewrite solves to the same result except where the fused
+    operator avoids an overflow or precision loss of the original
+    """
+    def __init__(self, operator_registry: OperatorRegistry):
+        self.operator_registry = operator_registry
+
+    def optimize(self, postfix_queue) -> deque:
+        """
+        :param postfix_queue: postfix ordered queue, values may also be placeholders of any non str type
+        :return: optimized postfix queue, the original one if there's nothing to fuse or it's malformed
+        """
+        root = build_tree(postfix_queue, self.operator_registry, self._rewrite)
+        if root is None:
+            return postfix_queue
+        return flatten(root)
+
+    def _rewrite(self, node: Node) -> Node:
+        """
+        fuses a freshly built operator node with its left child when they form a known sequence
+        """
+        operator = self.operator_registry.get_operator(node.token)
+        left = node.children[0]
+        if not isinstance(left.token, str):
+            return node
+        left_operator = self.operator_registry.get_operator(left.token)
+
+        if type(operator) is Modulo and type(left_operator) is Power:
+            symbol = self._fused(MODULAR_POWER, lambda: ModularPower(MODULAR_POWER, left_operator, operator))
+            return Node(symbol, left.children + node.children[1:])
+
+        if type(operator) is Add and type(left_operator) is Multiply:
+            symbol = self._fused(MULTIPLY_ADD, lambda: MultiplyAdd(MULTIPLY_ADD))
+            return Node(symbol, left.children + node.children[1:])
+
+        if type(operator) in REDUCIBLE:
+            chained = left_operator.operator if isinstance(left_operator, Reduction) else left_operator
+            if chained is operator:
+                arity = len(left.children) + 1
+                symbol = self._fused(f"{node.token}{arity}", lambda: Reduction(f"{node.token}{arity}", operator, arity))
+                return Node(symbol, left.children + node.children[1:])
+
+        return node
+
+    def _fused(self, symbol: str, create) -> str:
+        """
+        registers a fused operator the first time it's needed
+        :param symbol: symbol of the fused operator
+        :param create: builds the operator if it isn't registered yet
+        :return: the symbol
+        """
+        if symbol not in self.operator_registry.operators:
+            self.operator_registry.register(create())
+        return symbol
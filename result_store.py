@@ -0,0 +1,166 @@
+import math
+import sqlite3
+import time
+from lexer import _normalize
+
+_LOOKUP_CHUNK = 500  # stays below sqlite's limit of host parameters per statement
+_EVICTION_SLACK = 0.9  # eviction trims the store to this fraction of max_entries so it doesn't run on every insert
+_TOUCH_BATCH = 1000  # lookups whose last_used is written in one go, reads never write on their own
+
+
+class ResultStore:
+    """
+    persistent cache of expression results in a local sqlite file, keyed by the normalized expression and the
+    fingerprint of the registry that solved it so results of different operator sets never mix,
+    it's only a cache: a database that's locked or broken makes lookups miss and stores do nothing
+    """
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # readers in other processes don't block on writers
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "fingerprint TEXT NOT NULL, expression TEXT NOT NULL, value REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (fingerprint, expression)) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.connection.commit()
+
+        self._entries = self._count()
+        self._touched = {}  # (fingerprint, expression) -> time it was last found, not written yet
+
+    def get(self, fingerprint: str, expression: str):
+        """
+        :param fingerprint: fingerprint of the registry the result belongs to
+        :param expression: mathematical expression as string
+        :return: stored result as float, None if it isn't stored
+        """
+        return self.get_many(fingerprint, [expression])[0]
+
+    def get_many(self, fingerprint: str, expressions: list[str]) -> list:
+        """
+        looks up a whole batch of expressions with as few queries as possible
+        :param fingerprint: fingerprint of the registry the results belong to
+        :param expressions: mathematical expressions as strings
+        :return: list with the stored result as float or None for every expression, in input order
+        """
+        keys = [_normalize(expression) for expression in expressions]
+        found = {}
+
+        unique_keys = list(dict.fromkeys(keys))
+        try:
+            for start in range(0, len(unique_keys), _LOOKUP_CHUNK):
+                chunk = unique_keys[start:start + _LOOKUP_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT expression, value FROM results WHERE fingerprint = ? AND expression IN ({placeholders})",
+                    [fingerprint, *chunk]
+                )
+                found.update(rows)
+        except sqlite3.Error:
+            return [None] * len(keys)
+
+        if found:
+            now = time.time()
+            self._touched.update(((fingerprint, key), now) for key in found)
+            if len(self._touched) >= _TOUCH_BATCH:
+                self.flush()
+
+        return [found.get(key) for key in keys]
+
+    def put(self, fingerprint: str, expression: str, value: float):
+        """
+        :param fingerprint: fingerprint of the registry that solved the expression
+        :param expression: mathematical expression as string
+        :param value: result of the expression
+        """
+        self.put_many(fingerprint, [(expression, value)])
+
+    def put_many(self, fingerprint: str, results):
+        """
+        stores a batch of results in one transaction, evicting the least recently used ones when the store is full
+        :param fingerprint: fingerprint of the registry that solved the expressions
+        :param results: iterable of (expression, value) pairs, nan values can't be stored in sqlite and are skipped
+        """
+        now = time.time()
+        rows = [(fingerprint, _normalize(expression), value, now)
+                for expression, value in results if not math.isnan(value)]
+        if not rows:
+            return
+
+        try:
+            self._write_touched()
+            cursor = self.connection.executemany(
+                "INSERT OR REPLACE INTO results (fingerprint, expression, value, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._entries += cursor.rowcount
+            if self._entries > self.max_entries:
+                self._evict()
+        except sqlite3.Error:
+            self._rollback()
+            return
+        self._commit()
+
+    def _write_touched(self):
+        """
+        writes the last_used time of the results found since the last write, inside the caller's transaction
+        """
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        self.connection.executemany(
+            "UPDATE results SET last_used = ? WHERE fingerprint = ? AND expression = ?",
+            [(now, fingerprint, key) for (fingerprint, key), now in touched.items()]
+        )
+
+    def flush(self):
+        """
+        writes the last_used times that are still only kept in memory
+        """
+        try:
+            self._write_touched()
+        except sqlite3.Error:
+            self._rollback()
+            return
+        self._commit()
+
+    def _commit(self):
+        try:
+            self.connection.commit()
+        except sqlite3.Error:
+            self._rollback()
+
+    def _rollback(self):
+        try:
+            self.connection.rollback()
+        except sqlite3.Error:  # the connection itself is broken, nothing left to undo
+            pass
+
+    def _evict(self):
+        """
+        deletes the least recently used results until the store is back under its size limit
+        """
+        self._entries = self._count()  # other processes may have written since we last counted
+        excess = self._entries - int(self.max_entries * _EVICTION_SLACK)
+        if excess <= 0:
+            return
+
+        self.connection.execute(
+            "DELETE FROM results WHERE (fingerprint, expression) IN "
+            "(SELECT fingerprint, expression FROM results ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self._entries -= excess
+
+    def _count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._count()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
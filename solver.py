@@ -1,5 +1,5 @@
 from collections import deque
-from operands import OperatorBinary, OperatorUnary
+from operands import OperatorBinary, OperatorUnary, OperatorFused
 from exceptions import SolverException, OperationExecutionError
 
 
@@ -61,5 +61,13 @@ class Solver:
 
             stack.append(operator.calculate(stack.pop()))
 
+        elif isinstance(operator, OperatorFused):
+            if len(stack) < operator.arity:
+                raise OperationExecutionError(f"[ERROR] not enough values for fused operator {symbol}")
+
+            operands = stack[-operator.arity:]
+            del stack[-operator.arity:]
+            stack.append(operator.calculate(*operands))
+
         else:
             raise OperationExecutionError(f"[ERROR] unknown operator type: {type(operator)}")
@@ -0,0 +1,101 @@
+from lexer import Placeholder
+from optimizer import Node, build_tree, flatten
+from compiler import compile_program
+from template import Template
+from exceptions import TemplateException, UnboundVariableError
+
+
+class ResidualProgram:
+    """
+    what's left of a formula once some of its {name} variables are bound, every part that only depended on
+    bound values is already solved, so evaluating it only does the work that depends on the remaining variables
+    """
+    def __init__(self, expression: str, postfix_queue, program, column_solver):
+        self.expression = expression
+        self.postfix = postfix_queue
+        self.program = program
+        self.names = program.names  # variables still free, in the order __call__ takes them
+        self.template = Template(expression, postfix_queue, column_solver)
+
+    def __call__(self, *values: float) -> float:
+        """
+        :param values: value of every free variable, in the order of names
+        :return: result as float
+        """
+        return self.program(*(float(value) for value in values))
+
+    def evaluate(self, **values: float) -> float:
+        """
+        :param values: value of every free variable by name
+        :return: result as float
+        """
+        missing = [name for name in self.names if name not in values]
+        if missing:
+            raise UnboundVariableError(f"[ERROR] no value given for variables: {', '.join(missing)}")
+        return self.program(*(float(values[name]) for name in self.names))
+
+    def evaluate_columns(self, columns: dict, row_count: int) -> tuple[list, list]:
+        """
+        evaluates the residual for whole columns of the free variables, see Template.evaluate_columns
+        """
+        return self.template.evaluate_columns(columns, row_count)
+
+
+class PartialEvaluator:
+    """
+    specializes formulas for fixed values of some of their variables
+    """
+    def __init__(self, lexer, parser, operator_registry, column_solver, optimizer=None):
+        """
+        :param lexer: lexer that allows placeholders
+        """
+        self.lexer = lexer
+        self.parser = parser
+        self.operator_registry = operator_registry
+        self.column_solver = column_solver
+        self.optimizer = optimizer
+
+    def specialize(self, expression: str, bindings: dict) -> ResidualProgram:
+        """
+        binds variables to constants and solves every subtree that depends on bound values only
+        :param expression: mathematical expression with {name} variables
+        :param bindings: dict of variable name to its fixed value
+        :return: ResidualProgram taking the variables that weren't bound
+        """
+        postfix_q = self.parser.parse(self.lexer.tokenize(expression))
+
+        names = {token.name for token in postfix_q if isinstance(token, Placeholder)}
+        unknown = [name for name in bindings if name not in names]
+        if unknown:
+            raise TemplateException(f"[ERROR] expression has no variables named: {', '.join(unknown)}")
+
+        bound = [float(bindings[token.name]) if isinstance(token, Placeholder) and token.name in bindings else token
+                 for token in postfix_q]
+
+        root = build_tree(bound, self.operator_registry, self._fold)
+        residual = flatten(root) if root is not None else bound
+        if self.optimizer is not None:
+            residual = self.optimizer.optimize(residual)
+
+        program = compile_program(residual, self.operator_registry)
+        if program is None:
+            raise TemplateException(f"[ERROR] expression can't be solved: {expression}")
+        return ResidualProgram(expression, residual, program, self.column_solver)
+
+    def _fold(self, node: Node) -> Node:
+        """
+        solves an operator node right away when it's pure and all its operands are constants,
+        a node that fails is kept so the error is raised when the residual is evaluated, in the usual order
+        """
+        operator = self.operator_registry.get_operator(node.token)
+        if not operator.pure:
+            return node
+
+        operands = [child.token for child in node.children]
+        if not all(isinstance(operand, float) and not isinstance(operand, Placeholder) for operand in operands):
+            return node
+
+        try:
+            return Node(operator.calculate(*operands))
+        except Exception:
+            return node
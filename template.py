@@ -0,0 +1,217 @@
+import csv
+import queue
+import threading
+from collections import deque
+from lexer import Placeholder
+from exceptions import InvalidNumberError, MissingColumnError, TemplateException
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only .npy files need it
+    np = None
+
+DEFAULT_CHUNK_SIZE = 10_000
+_PREFETCH = 2  # chunks buffered between reader, solver and writer, bounds the memory of a pipeline
+_DONE = object()
+
+
+class Template:
+    """
+    expression compiled once with {name} placeholders, solved for whole columns of values at a time
+    """
+    def __init__(self, template: str, postfix_queue: deque, column_solver):
+        self.template = template
+        self.program = tuple(postfix_queue)
+        self.column_solver = column_solver
+        self.names = list(dict.fromkeys(token.name for token in self.program if isinstance(token, Placeholder)))
+
+    def evaluate_columns(self, columns: dict, row_count: int, errors: list = None) -> tuple[list, list]:
+        """
+        solves the template for every row of the given columns
+        :param columns: dict of placeholder name to column (list or array) of floats
+        :param row_count: amount of rows in every column
+        :param errors: optional errors per row known beforehand (e.g. unreadable cells), those rows are skipped
+        :return: tuple of (values, errors), each a list with an entry per row
+        """
+        missing = [name for name in self.names if name not in columns]
+        if missing:
+            raise MissingColumnError(f"[ERROR] no column given for placeholders: {', '.join(missing)}")
+
+        program = [columns[token.name] if isinstance(token, Placeholder) else token for token in self.program]
+        return self.column_solver.solve_columns(program, row_count, errors)
+
+
+def _chunked(rows, chunk_size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_pipeline(chunks, compute, write):
+    """
+    reads chunks on one thread and writes results on another while the calling thread computes,
+    at most _PREFETCH chunks wait on either side so memory stays bounded
+    :param chunks: iterable of input chunks, consumed on the reader thread
+    :param compute: turns an input chunk into an output chunk
+    :param write: consumes output chunks, called on the writer thread
+    """
+    read_queue = queue.Queue(maxsize=_PREFETCH)
+    write_queue = queue.Queue(maxsize=_PREFETCH)
+    stop = threading.Event()
+    failures = []
+
+    def reader():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                read_queue.put(chunk)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            read_queue.put(_DONE)
+
+    def writer():
+        while (chunk := write_queue.get()) is not _DONE:
+            if failures:
+                continue  # keep draining so the solver never blocks on a dead writer
+            try:
+                write(chunk)
+            except Exception as e:
+                failures.append(e)
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    chunk = None
+    try:
+        while not failures and (chunk := read_queue.get()) is not _DONE:
+            write_queue.put(compute(chunk))
+    finally:
+        stop.set()
+        while chunk is not _DONE:
+            chunk = read_queue.get()
+        write_queue.put(_DONE)
+        writer_thread.join()
+        reader_thread.join()
+
+    if failures:
+        raise failures[0]
+
+
+def _read_column(rows: list, index: int, name: str, errors: list) -> list[float]:
+    column = []
+    for row_number, row in enumerate(rows):
+        try:
+            column.append(float(row[index]))
+        except (ValueError, IndexError):
+            column.append(0.0)
+            if errors[row_number] is None:
+                errors[row_number] = InvalidNumberError(f"[ERROR] column {name} has no valid number in this row")
+    return column
+
+
+def evaluate_csv(template: Template, input_path: str, output_path: str, column_name: str = "result",
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, error_column: str = None) -> int:
+    """
+    solves the template for every row of a csv file whose header names the placeholders, writing a copy of the file
+    with the result as a new column, rows that fail get an empty result
+    :param template: compiled template
+    :param input_path: csv file to read
+    :param output_path: csv file to write
+    :param column_name: header of the result column
+    :param chunk_size: rows solved at a time
+    :param error_column: optional header of an extra column with the error message of failed rows
+    :return: amount of rows written
+    """
+    written = [0]
+
+    with open(input_path, newline="") as source, open(output_path, "w", newline="") as target:
+        rows = csv.reader(source)
+        header = next(rows, None)
+        if header is None:
+            raise TemplateException(f"[ERROR] {input_path} has no header row")
+
+        missing = [name for name in template.names if name not in header]
+        if missing:
+            raise MissingColumnError(f"[ERROR] {input_path} has no columns named: {', '.join(missing)}")
+        indices = {name: header.index(name) for name in template.names}
+
+        output = csv.writer(target)
+        output.writerow(header + [column_name] + ([error_column] if error_column else []))
+
+        def compute(chunk: list) -> list:
+            errors = [None] * len(chunk)
+            columns = {name: _read_column(chunk, index, name, errors) for name, index in indices.items()}
+            values, errors = template.evaluate_columns(columns, len(chunk), errors)
+
+            output_rows = []
+            for row, value, error in zip(chunk, values, errors):
+                row.append("" if value is None else repr(value))
+                if error_column:
+                    row.append("" if error is None else str(error))
+                output_rows.append(row)
+            return output_rows
+
+        def write(output_rows: list):
+            output.writerows(output_rows)
+            written[0] += len(output_rows)
+
+        _run_pipeline(_chunked(rows, chunk_size), compute, write)
+
+    return written[0]
+
+
+def evaluate_npy(template: Template, input_path: str, output_path: str, column_name: str = "result",
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    solves the template for every row of a structured .npy array (memory mapped, never fully loaded) whose field names
+    are the placeholders, writing a copy with the result as a new field, rows that fail get nan
+    :param template: compiled template
+    :param input_path: .npy file holding a one dimensional structured array
+    :param output_path: .npy file to write
+    :param column_name: name of the result field
+    :param chunk_size: rows solved at a time
+    :return: amount of rows written
+    """
+    if np is None:
+        raise TemplateException("[ERROR] numpy is required to evaluate .npy files")
+
+    source = np.load(input_path, mmap_mode="r")
+    if source.dtype.names is None or source.ndim != 1:
+        raise TemplateException(f"[ERROR] {input_path} must hold a one dimensional array with named fields")
+
+    missing = [name for name in template.names if name not in source.dtype.names]
+    if missing:
+        raise MissingColumnError(f"[ERROR] {input_path} has no fields named: {', '.join(missing)}")
+
+    target = np.lib.format.open_memmap(output_path, mode="w+", shape=source.shape,
+                                       dtype=np.dtype(source.dtype.descr + [(column_name, "f8")]))
+
+    def read():
+        for start in range(0, len(source), chunk_size):
+            yield start, np.array(source[start:start + chunk_size])  # copy pages in on the reader thread
+
+    def compute(item: tuple) -> tuple:
+        start, chunk = item
+        columns = {name: chunk[name].astype(float) for name in template.names}
+        values, _ = template.evaluate_columns(columns, len(chunk))
+        return start, chunk, np.array([np.nan if value is None else value for value in values], dtype=float)
+
+    def write(item: tuple):
+        start, chunk, result = item
+        rows = target[start:start + len(chunk)]
+        for name in source.dtype.names:
+            rows[name] = chunk[name]
+        rows[column_name] = result
+
+    _run_pipeline(read(), compute, write)
+    target.flush()
+    return len(source)
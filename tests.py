@@ -1,7 +1,20 @@
 
+import json
+import os
+import socket
+import threading
+from functools import partial
 import pytest
 from exceptions import *
 from calculator import Calculator
+from result_store import ResultStore
+from watcher import ExpressionFileWatcher
+from template import evaluate_csv
+from distributed import Coordinator, run_worker, _decode_error
+from cost import longest_first, split_by_cost
+from metrics import LatencyHistogram
+from lexer import Placeholder
+from operands import digit_sum_int, CustomBinary, CustomUnary, LEFT_PLACED
 
 calculator = Calculator()
 
@@ -145,3 +158,454 @@ def test_complex_equations():
     assert calculator.calculate("10+20 -5*2+99#+(1$0)-1") == 38.0
 
     assert calculator.calculate("(2+1)!+(100/10  )-10+(0@0)") == 6.0
+
+
+def test_batch_matches_calculate():
+    expressions = ["1+2*3", "4+5*6", "7+8*9", "3!+2", "10/0+1", "5/5+1", "(~2)!", "2^3!", "12#*3",
+                   "3^*2", "", "1e5", "10$20&15@5", "1)+a", "1+)a"]
+
+    batch = calculator.calculate_batch(expressions)
+
+    assert len(batch) == len(expressions)
+    for expression, value, error in zip(expressions, batch.values, batch.errors):
+        try:
+            expected = calculator.calculate(expression)
+        except Exception as e:
+            assert value is None
+            assert type(error) is type(e)
+        else:
+            assert error is None
+            assert value == expected
+
+    assert batch.failed == [error is not None for error in batch.errors]
+    assert batch.failed[4] and not batch.failed[5]
+
+
+def test_result_store(tmp_path):
+    path = str(tmp_path / "results.db")
+    store = ResultStore(path, max_entries=10)
+    stored_calculator = Calculator(result_store=store)
+    fingerprint = stored_calculator.registry.fingerprint()
+
+    assert stored_calculator.calculate("20 !") == calculator.calculate("20!")
+    assert store.get(fingerprint, "20!") == calculator.calculate("20!")
+    assert store.get("other registry", "20!") is None
+
+    batch = stored_calculator.calculate_batch(["20!", "1+1", "1/0"])
+    assert batch.values[:2] == [calculator.calculate("20!"), 2.0]
+    assert isinstance(batch.errors[2], DivideByZeroException)
+    assert store.get(fingerprint, "1+1") is None  # too cheap to be worth storing
+
+    storing_everything = Calculator(result_store=store, store_min_cost=0)
+    storing_everything.calculate_batch([f"{i}+1" for i in range(30)])
+    assert len(store) <= 10
+    store.close()
+
+    reopened = ResultStore(path)
+    assert reopened.get_many(fingerprint, ["29 + 1", "1/0"]) == [30.0, None]
+    reopened.close()
+
+    broken = ResultStore(path)
+    broken_calculator = Calculator(result_store=broken)
+    broken.connection.close()
+    assert broken_calculator.calculate("20!") == calculator.calculate("20!")
+    assert broken_calculator.calculate_batch(["20!", "1+1"]).values == [calculator.calculate("20!"), 2.0]
+
+
+def test_watcher_recalculates_changed_lines(tmp_path):
+    path = tmp_path / "formulas.txt"
+    path.write_text("1+1\n3!\n\n1/0\n2.5*2\n")
+    watcher = ExpressionFileWatcher(Calculator(), [str(path)])
+
+    assert watcher.run_once() == {str(path): 4}
+    assert (tmp_path / "formulas.txt.out").read_text().splitlines() == \
+           ["2", "6", "", "[ERROR] division by zero not allowed", "5"]
+    assert watcher.run_once() == {}
+
+    path.write_text("1+1\n4!\n\n1/0\n2.5*2\n1+1\n")
+    os.utime(path, ns=(0, 0))
+    assert watcher.run_once() == {str(path): 1}
+    assert (tmp_path / "formulas.txt.out").read_text().splitlines() == \
+           ["2", "24", "", "[ERROR] division by zero not allowed", "5", "2"]
+
+    broken = tmp_path / "broken.txt"
+    broken.write_bytes(b"1+\xff\n")
+    os.utime(broken, ns=(0, 0))
+    path.write_text("2+2\n")
+    watcher = ExpressionFileWatcher(Calculator(), [str(broken), str(path)])
+    assert watcher.run_once() == {str(path): 1}  # the unreadable file doesn't stop the others
+
+    broken.write_bytes(b"1+2\n")  # same size and time, only a retry can notice it
+    os.utime(broken, ns=(0, 0))
+    assert watcher.run_once() == {str(broken): 1}
+    assert (tmp_path / "broken.txt.out").read_text() == "3\n"
+
+
+def test_csv_template(tmp_path):
+    source = tmp_path / "input.csv"
+    source.write_text("a,b,name\n1,2,x\n3,0,y\n5,oops,z\n4,1,w\n")
+    target = tmp_path / "output.csv"
+
+    template = calculator.compile_template("{a} * 2 + {a} / {b} - 1")
+    assert template.names == ["a", "b"]
+
+    assert evaluate_csv(template, str(source), str(target), "score", chunk_size=2, error_column="error") == 4
+    rows = target.read_text().splitlines()
+    assert rows[0] == "a,b,name,score,error"
+    assert rows[1] == "1,2,x,1.5,"
+    assert rows[2].startswith("3,0,y,,[ERROR] division by zero")
+    assert rows[3].startswith("5,oops,z,,[ERROR] column b")
+    assert rows[4] == "4,1,w,11.0,"
+
+    with pytest.raises(MissingColumnError):
+        evaluate_csv(calculator.compile_template("{c}!"), str(source), str(target))
+
+    with pytest.raises(IllegalCharacterError):
+        calculator.calculate("{a}+1")
+
+
+def test_digit_sum():
+    assert calculator.calculate("(10^20)#") == 1.0
+    assert calculator.calculate("(~123)#") == 6.0
+    assert calculator.calculate("(2^52)#") == sum(map(int, str(2 ** 52)))
+    assert calculator.calculate("(2^70)#") == sum(map(int, "11805916207174113"))  # digits of 1.1805916207174113e+21
+    assert calculator.calculate("100000000000000000000000#") == 1.0  # not the 42 of 100000000000000008388608
+    assert calculator.calculate("(10^23)#") == 2.0  # pow gives 1.0000000000000001e+23
+    assert calculator.calculate_batch(["(10^23)#", "100000000000000000000000#"]).values == [2.0, 1.0]
+    assert calculator.calculate("(0.5^20)#") == sum(map(int, "95367431640625"))
+
+    huge = 7 ** 4000
+    assert digit_sum_int(huge) == sum(map(int, str(huge)))
+    assert digit_sum_int(0) == 0
+
+    with pytest.raises(OperandException):
+        assert calculator.calculate("(10^200*10^200)#")
+
+
+def test_peephole_fusion():
+    optimized = Calculator(optimize=True)
+
+    for expression in ["(3^4)%5", "2*3+4", "1$5$3$2", "1&5&3", "1@5@3@7", "2*3+4*5+6", "(2^0.5)%1",
+                       "(~2^3)%5", "(2^3)%0", "((1$2)$3)*4+5", "1/0+2*3"]:
+        try:
+            expected = calculator.calculate(expression)
+        except Exception as e:
+            with pytest.raises(type(e)):
+                optimized.calculate(expression)
+        else:
+            assert optimized.calculate(expression) == expected
+
+    assert list(optimized.parser.parse(optimized.lexer.tokenize("1$2$3$4"))) == [1.0, 2.0, '$', 3.0, '$', 4.0, '$']
+    assert list(optimized.optimizer.optimize(optimized.parser.parse(optimized.lexer.tokenize("1$2$3$4")))) == \
+           [1.0, 2.0, 3.0, 4.0, '$4']
+
+    with pytest.raises(OverflowError):
+        calculator.calculate("(7^1000)%13")
+    assert optimized.calculate("(7^1000)%13") == float(pow(7, 1000, 13))
+    assert optimized.calculate_batch(["(7^1000)%13", "(3^4)%5"]).values == [float(pow(7, 1000, 13)), 1.0]
+
+
+def test_fused_results_are_stored_apart(tmp_path):
+    store = ResultStore(str(tmp_path / "results.db"))
+    assert Calculator(result_store=store, optimize=True).calculate("(7^1000)%13") == float(pow(7, 1000, 13))
+    with pytest.raises(OverflowError):
+        Calculator(result_store=store).calculate("(7^1000)%13")
+    assert Calculator(result_store=store).calculate_batch(["(7^1000)%13"]).values == [None]
+    store.close()
+
+
+def test_fused_array_kernels():
+    np = pytest.importorskip("numpy")
+    optimized = Calculator(optimize=True)
+    columns = {name: np.arange(1.0, 2001.0) * factor for name, factor in (("a", 0.5), ("b", -1.5), ("c", 3.0))}
+
+    for template in ["{a}*{b}+{c}", "{a}${b}${c}", "{a}&{b}&{c}", "{a}@{b}@{c}@{a}"]:
+        fused = optimized.compile_template(template)
+        assert any(isinstance(token, str) and len(token) > 1 for token in fused.program)
+
+        operator = optimized.registry.get_operator(fused.program[-1])
+        assert operator.calculate_array is not None
+        values, errors = fused.evaluate_columns(columns, 2000)
+        assert (values, errors) == calculator.compile_template(template).evaluate_columns(columns, 2000)
+
+
+def test_custom_operators(tmp_path):
+    custom = Calculator(result_store=ResultStore(str(tmp_path / "results.db")))
+    fingerprint = custom.registry.fingerprint()
+
+    custom.register_operator(CustomBinary('?', 2, lambda a, b: a * 10 + b, exact_function=lambda a, b: a * 10 + b,
+                                          cost=2.0))
+    assert custom.registry.fingerprint() != fingerprint
+    assert custom.calculate("1+2?3") == 24.0
+    assert custom.calculate_batch(["1?2", "3?4+1", "(~1)?2.5"]).values == [12.0, 35.0, -7.5]
+
+    calls = []
+
+    def tick(value):
+        calls.append(value)
+        return value + len(calls)
+
+    custom.register_operator(CustomUnary('`', 7, LEFT_PLACED, tick, pure=False))
+    assert custom.calculate_batch(["`1", "`1"]).values == [2.0, 3.0]
+    assert custom.calculate("`1") == 4.0
+    assert custom.calculate("`1") == 5.0
+    assert custom.result_store.get(custom.registry.fingerprint(), "`1") is None
+
+    adding, multiplying, adding_again = Calculator(), Calculator(), Calculator()
+    adding.register_operator(CustomBinary('?', 2, lambda a, b: a + b))
+    multiplying.register_operator(CustomBinary('?', 2, lambda a, b: a * b))
+    adding_again.register_operator(CustomBinary('?', 2, lambda a, b: a + b))
+    assert adding.registry.fingerprint() != multiplying.registry.fingerprint()
+    assert adding.registry.fingerprint() == adding_again.registry.fingerprint()
+
+    exact_adding = Calculator()
+    exact_adding.register_operator(CustomBinary('?', 2, lambda a, b: a + b, exact_function=lambda a, b: a * b))
+    assert exact_adding.registry.fingerprint() != adding.registry.fingerprint()
+
+    def factorial_factory():
+        def factorial(n):
+            return 1 if n < 2 else n * factorial(n - 1)
+        return factorial
+
+    recursive = CustomUnary('`', 7, LEFT_PLACED, factorial_factory())
+    assert recursive.storable and recursive.calculate(5.0) == 120.0
+    assert CustomBinary('?', 2, partial(max)).version != CustomBinary('?', 2, partial(min)).version
+
+    stateful = Calculator(result_store=ResultStore(str(tmp_path / "stateful.db")), store_min_cost=0)
+    weights = [2.0]
+    stateful.register_operator(CustomBinary('?', 2, lambda a, b: a * weights[0] + b))
+    assert not stateful.registry.get_operator('?').storable
+    assert stateful.calculate("1?2") == 4.0
+    assert stateful.result_store.get(stateful.registry.fingerprint(), "1?2") is None
+
+    with pytest.raises(OperatorRegistrationError):
+        custom.register_operator(CustomBinary('+', 1, lambda a, b: a + b))
+    with pytest.raises(OperatorRegistrationError):
+        custom.register_operator(CustomBinary('(', 1, lambda a, b: a + b))
+    with pytest.raises(IllegalCharacterError):
+        calculator.calculate("1?2")
+
+
+def test_distributed_workers_on_localhost():
+    coordinator = Coordinator(chunk_size=3)
+    expressions = [f"{i}*2+1" for i in range(20)] + ["1/0", "3!", "bad"]
+    dying_worker_done = threading.Event()
+
+    def dying_worker():
+        with socket.create_connection(coordinator.address) as connection:
+            connection.makefile("rb").readline()  # takes a chunk and dies before answering
+        dying_worker_done.set()
+
+    def worker():
+        dying_worker_done.wait()
+        run_worker(*coordinator.address)
+
+    threads = [threading.Thread(target=dying_worker), threading.Thread(target=worker),
+               threading.Thread(target=worker)]
+    for thread in threads:
+        thread.start()
+
+    results = list(coordinator.run(expressions))
+    coordinator.close()
+    for thread in threads:
+        thread.join()
+
+    assert [value for value, _ in results[:20]] == [i * 2 + 1.0 for i in range(20)]
+    assert isinstance(results[20][1], DivideByZeroException)
+    assert results[21] == (6.0, None)
+    assert isinstance(results[22][1], IllegalCharacterError)
+    assert coordinator.retries == 1
+
+
+def test_distributed_malformed_replies_are_retried():
+    coordinator = Coordinator(chunk_size=10)
+    broken_worker_done = threading.Event()
+
+    def broken_worker():
+        with socket.create_connection(coordinator.address) as connection, connection.makefile("rwb") as stream:
+            chunk = json.loads(stream.readline())
+            stream.write(json.dumps({"chunk": chunk["chunk"]}).encode() + b"\n")  # answers without results
+            stream.flush()
+            stream.readline()
+        broken_worker_done.set()
+
+    def worker():
+        broken_worker_done.wait()
+        run_worker(*coordinator.address)
+
+    threads = [threading.Thread(target=broken_worker), threading.Thread(target=worker)]
+    for thread in threads:
+        thread.start()
+
+    assert [value for value, _ in coordinator.run(["1+1", "2*3"])] == [2.0, 6.0]
+    coordinator.close()
+    for thread in threads:
+        thread.join()
+    assert coordinator.retries == 1
+
+    error = _decode_error({"type": "UnicodeDecodeError", "message": "bad byte"})
+    assert isinstance(error, RemoteEvaluationError) and "bad byte" in str(error)
+    assert isinstance(_decode_error({"type": "DivideByZeroException", "message": "x"}), DivideByZeroException)
+
+
+def test_distributed_stalled_worker_times_out():
+    coordinator = Coordinator(chunk_size=2, reply_timeout=0.5)
+    stalled = threading.Event()
+    release = threading.Event()
+
+    def stalling_worker():
+        with socket.create_connection(coordinator.address) as connection, connection.makefile("rb") as stream:
+            stream.readline()  # takes a chunk and goes silent without disconnecting
+            stalled.set()
+            release.wait()
+
+    def worker():
+        stalled.wait()
+        run_worker(*coordinator.address)
+
+    threads = [threading.Thread(target=stalling_worker), threading.Thread(target=worker)]
+    for thread in threads:
+        thread.start()
+
+    assert [value for value, _ in coordinator.run([f"{i}+1" for i in range(6)])] == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    release.set()
+    coordinator.close()
+    for thread in threads:
+        thread.join()
+    assert coordinator.retries == 1
+
+
+def test_distributed_results_stream_by_window():
+    coordinator = Coordinator(chunk_size=2, window_chunks=2)
+    consumed = []
+
+    def expressions():
+        for i in range(40):
+            consumed.append(i)
+            yield f"{i}*3" if i % 5 else f"{i}+20!"
+
+    worker = threading.Thread(target=run_worker, args=coordinator.address)
+    worker.start()
+
+    results = coordinator.run(expressions())
+    assert next(results) == (calculator.calculate("0+20!"), None)
+    assert len(consumed) <= 8  # only the first two windows were read
+    assert [value for value, _ in results] == [calculator.calculate(f"{i}*3" if i % 5 else f"{i}+20!")
+                                               for i in range(1, 40)]
+    coordinator.close()
+    worker.join()
+
+
+def test_cost_model_and_scheduling():
+    cheap = calculator.estimate_cost("1+2")
+    assert calculator.estimate_cost("3000!") > 100 * cheap
+    assert calculator.estimate_cost("(2^1000)%7") > calculator.estimate_cost("(2^2)%7")
+    assert calculator.estimate_cost("~3!") < calculator.estimate_cost("~300!")
+    assert calculator.estimate_cost("bad") > 0
+    for expression in ["1+2", "3000!", "2^1000", "~300!", "12#*3", "bad"]:
+        assert calculator.cost_model.scan_expression(expression) == calculator.estimate_cost(expression)
+
+    costs = [calculator.estimate_cost(expression) for expression in ["1+2"] * 6 + ["3000!", "2000!"]]
+    assert longest_first(costs)[:2] == [6, 7]
+    chunks = split_by_cost(costs, 4)
+    assert chunks[0] == [6]
+    assert sorted(index for chunk in chunks for index in chunk) == list(range(8))
+    assert all(len(chunk) <= 4 for chunk in chunks)
+
+
+def test_tiered_execution():
+    tiered = Calculator(hot_threshold=3, max_hot_tokens=20)
+    untiered = Calculator(hot_threshold=None)
+
+    for expression in ["(3+5)*2-4/2^  2", "5!/10$5+ (99#)", "2^3!+1", "1.5 @ 4.5"]:
+        expected = untiered.calculate(expression)
+        assert [tiered.calculate(expression) for _ in range(5)] == [expected] * 5
+
+    stats = tiered.tier_stats()
+    assert stats["cold_runs"] == 4 * 2
+    assert stats["hot_runs"] == 4 * 3
+    assert stats["promotions"] == 4
+    assert stats["evictions"] > 0
+    assert stats["hot_tokens"] <= 20
+
+    for _ in range(5):
+        with pytest.raises(DivideByZeroException):
+            tiered.calculate("1/0")
+        with pytest.raises(PlacementError):
+            tiered.calculate("3^*2")
+    assert untiered.tier_stats() == {}
+
+
+def test_operator_memoization():
+    memoized = Calculator(hot_threshold=None, memo_sizes={'!': 2, '^': 8, '#': 8})
+
+    for expression in ["20!+1", "20!*2", "(~0)!", "0!", "2^0.5", "2^0.5+1", "(19!)#", "20!"]:
+        assert memoized.calculate(expression) == calculator.calculate(expression)
+
+    stats = memoized.memo_stats()
+    assert set(stats) == {'!', '^', '#'}
+    assert stats['!']["hits"] == 1 and stats['!']["misses"] == 5 and stats['!']["entries"] == 2
+    assert stats['^']["hits"] == 1 and stats['^']["hit_rate"] == 0.5
+
+    with pytest.raises(OperandException):
+        memoized.calculate("(~1)!")
+    with pytest.raises(OperandException):
+        CustomUnary('`', 7, LEFT_PLACED, lambda value: value, pure=False).memoize(4)
+    assert Calculator(memo_sizes={}).memo_stats() == {}
+
+
+def test_latency_metrics():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):
+        histogram.record(value * 1000)
+    assert histogram.count == 1000
+    assert 470_000 <= histogram.percentile(50) <= 530_000
+    assert 940_000 <= histogram.percentile(99) <= 1_000_000
+    assert histogram.percentile(100) == 1_000_000
+    assert LatencyHistogram().percentile(99) == 0
+
+    measured = Calculator(slow_threshold_ns=0, hot_threshold=2)
+    for _ in range(3):
+        measured.calculate("(3+5)*2!")
+    with pytest.raises(DivideByZeroException):
+        measured.calculate("1/0")
+
+    dump = measured.dump_metrics()
+    assert dump["histograms"]["total"]["count"] == 4
+    assert dump["histograms"]["lex"]["count"] == 3
+    assert dump["histograms"]["solve"]["count"] == 3
+    assert dump["histograms"]["total"]["p99_ns"] >= dump["histograms"]["total"]["p50_ns"] > 0
+
+    slow = dump["slow_expressions"]
+    assert len(slow) == 4
+    assert slow[0]["expression"] == "(3+5)*2!"
+    assert slow[0]["token_count"] == 8
+    assert slow[0]["max_stack_depth"] == 2
+    assert slow[0]["operators"] == ['+', '!', '*']
+    assert slow[3]["error"] == "[ERROR] division by zero not allowed"
+
+
+def test_partial_evaluation():
+    formula = "({a} * 2 + {b}!) * {x} + {c} / ({a} - 2) - {y}#"
+    residual = calculator.specialize(formula, {"a": 3, "b": 4, "c": 10})
+
+    assert residual.names == ["x", "y"]
+    assert list(residual.postfix) == [30.0, Placeholder("x"), '*', 10.0, '+', Placeholder("y"), '#', 'b-']
+    assert [token.name for token in residual.postfix if isinstance(token, Placeholder)] == ["x", "y"]
+    for x, y in [(1, 2), (2.5, 123), (0, 0)]:
+        expected = calculator.calculate(f"(3 * 2 + 4!) * {x} + 10 / (3 - 2) - {y}#")
+        assert residual.evaluate(x=x, y=y) == expected
+        assert residual(x, y) == expected
+
+    values, errors = residual.evaluate_columns({"x": [1.0, 2.0], "y": [12.0, 99.0]}, 2)
+    assert values == [30.0 + 10 - 3, 60.0 + 10 - 18] and errors == [None, None]
+
+    failing = calculator.specialize("{x} + {a} / 0", {"a": 1})
+    with pytest.raises(DivideByZeroException):
+        failing.evaluate(x=1)
+
+    assert calculator.specialize("{a}^2", {"a": 3})() == 9.0
+    with pytest.raises(UnboundVariableError):
+        residual.evaluate(x=1)
+    with pytest.raises(TemplateException):
+        calculator.specialize(formula, {"z": 1})
@@ -0,0 +1,148 @@
+import time
+from collections import OrderedDict
+from lexer import _normalize
+from compiler import compile_program
+
+DEFAULT_HOT_THRESHOLD = 8
+DEFAULT_MAX_HOT_TOKENS = 1 << 16  # memory cap of the hot tier, in tokens of compiled programs
+DEFAULT_MAX_TRACKED = 1 << 16  # expressions whose evaluation count is remembered
+
+
+class TierStats:
+    def __init__(self):
+        self.cold_runs = 0
+        self.hot_runs = 0
+        self.promotions = 0
+        self.evictions = 0
+        self.hot_entries = 0
+        self.hot_tokens = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class TieredExecutor:
+    """
+    counts how often every expression is calculated, cold expressions go through the lexer, parser and Solver,
+    once one is calculated hot_threshold times it's compiled (see compile_program) and later runs skip all three,
+    the least recently used compiled programs are dropped when the hot tier outgrows its memory cap
+    """
+    def __init__(self, lexer, parser, solver, operator_registry, optimizer=None,
+                 hot_threshold: int = DEFAULT_HOT_THRESHOLD, max_hot_tokens: int = DEFAULT_MAX_HOT_TOKENS,
+                 max_tracked: int = DEFAULT_MAX_TRACKED, metrics=None):
+        """
+        :param optimizer: optional PeepholeOptimizer applied to programs before they're solved or compiled
+        :param hot_threshold: calculations after which an expression is compiled, None to always interpret
+        :param max_hot_tokens: most tokens all compiled programs may have together
+        :param max_tracked: most expressions whose count is kept, the least recently seen are forgotten first
+        :param metrics: optional CalculationMetrics that get the duration of every stage
+        """
+        self.lexer = lexer
+        self.parser = parser
+        self.solver = solver
+        self.operator_registry = operator_registry
+        self.optimizer = optimizer
+        self.hot_threshold = hot_threshold
+        self.max_hot_tokens = max_hot_tokens
+        self.max_tracked = max_tracked
+        self.metrics = metrics
+
+        self.stats = TierStats()
+        self._counts = OrderedDict()
+        self._hot = OrderedDict()
+
+    def execute(self, expression: str) -> float:
+        """
+        calculates the expression in the tier it's currently in
+        :param expression: mathematical expression as string
+        :return: result as float
+        """
+        if self.hot_threshold is None:
+            return self._solve(self._parse(expression))
+
+        key = _normalize(expression)
+
+        program = self._hot.get(key)
+        if program is not None:
+            self._hot.move_to_end(key)
+            self.stats.hot_runs += 1
+            return self._run(program)
+
+        count = self._counts.pop(key, 0) + 1
+        self._counts[key] = count
+        if len(self._counts) > self.max_tracked:
+            self._counts.popitem(last=False)
+
+        postfix_q = self._parse(expression)
+
+        if count >= self.hot_threshold:
+            program = compile_program(postfix_q, self.operator_registry)
+            if program is not None:
+                self._promote(key, program)
+                self.stats.hot_runs += 1
+                return self._run(program)
+
+        self.stats.cold_runs += 1
+        return self._solve(postfix_q)
+
+    def _parse(self, expression: str):
+        """
+        lexes, parses and optimizes an expression, timing the lexer and the parser apart,
+        a lexer error is raised where the parser would have met it, so a parser error before it still wins
+        :return: postfix ordered queue
+        """
+        start = time.perf_counter_ns()
+        tokens = []
+        try:
+            for token in self.lexer.tokenize(expression):
+                tokens.append(token)
+        except Exception as e:
+            tokens = _replay(tokens, e)
+        lexed = time.perf_counter_ns()
+
+        postfix_q = self.parser.parse(tokens)
+        if self.optimizer is not None:
+            postfix_q = self.optimizer.optimize(postfix_q)
+
+        if self.metrics is not None:
+            self.metrics.record_stage("lex", lexed - start)
+            self.metrics.record_stage("parse", time.perf_counter_ns() - lexed)
+        return postfix_q
+
+    def _solve(self, postfix_q) -> float:
+        start = time.perf_counter_ns()
+        result = self.solver.solve(postfix_q)
+        if self.metrics is not None:
+            self.metrics.record_stage("solve", time.perf_counter_ns() - start)
+        return result
+
+    def _run(self, program) -> float:
+        start = time.perf_counter_ns()
+        result = program()
+        if self.metrics is not None:
+            self.metrics.record_stage("solve", time.perf_counter_ns() - start)
+        return result
+
+    def _promote(self, key: str, program):
+        """
+        moves a compiled program into the hot tier, evicting the least recently used ones over the memory cap
+        """
+        del self._counts[key]
+        self._hot[key] = program
+        self.stats.promotions += 1
+        self.stats.hot_entries += 1
+        self.stats.hot_tokens += program.size
+
+        while self.stats.hot_tokens > self.max_hot_tokens and self._hot:
+            _, evicted = self._hot.popitem(last=False)
+            self.stats.evictions += 1
+            self.stats.hot_entries -= 1
+            self.stats.hot_tokens -= evicted.size
+
+
+def _replay(tokens: list, error: Exception):
+    """
+    yields the tokens the lexer managed to read, then raises the error it stopped with
+    """
+    yield from tokens
+    raise error
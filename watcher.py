@@ -0,0 +1,117 @@
+import hashlib
+import os
+import time
+
+OUTPUT_SUFFIX = ".out"
+
+
+def format_result(result: float) -> str:
+    """
+    formats a result the way the interactive calculator prints it, whole numbers without the trailing .0
+    :param result: result of an expression
+    :return: result as string
+    """
+    if result.is_integer():
+        return str(int(result))
+    return str(result)
+
+
+def _line_hash(line: str) -> bytes:
+    return hashlib.blake2b(line.encode(), digest_size=16).digest()
+
+
+class WatchedFile:
+    """
+    state kept about a single expression file between runs
+    """
+    def __init__(self, path: str, output_suffix: str):
+        self.path = path
+        self.output_path = path + output_suffix
+        self.stamp = None
+        self.results = {}  # line hash -> formatted output of that line
+
+
+class ExpressionFileWatcher:
+    """
+    watches expression files (one expression per line) and writes the result of every line to a sidecar file,
+    when a file changes only the lines whose content is new are calculated again
+    """
+    def __init__(self, calculator, paths: list[str], output_suffix: str = OUTPUT_SUFFIX):
+        self.calculator = calculator
+        self.files = [WatchedFile(path, output_suffix) for path in paths]
+
+    def run_once(self) -> dict[str, int]:
+        """
+        checks every watched file once and refreshes the sidecar of the ones that changed, a file that can't be
+        read (deleted midway, not utf-8) is skipped and tried again on the next run
+        :return: dict of path to amount of lines that had to be calculated, only for files that changed
+        """
+        evaluated = {}
+
+        for watched in self.files:
+            try:
+                stat = os.stat(watched.path)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if stamp == watched.stamp:
+                    continue
+
+                evaluated[watched.path] = self._refresh(watched)
+            except (OSError, ValueError):  # ValueError covers UnicodeDecodeError
+                continue
+            watched.stamp = stamp  # only once it's refreshed, a failed file is retried even if it doesn't change
+
+        return evaluated
+
+    def watch(self, interval: float = 0.5, on_update=None):
+        """
+        polls the watched files forever, stops on KeyboardInterrupt
+        :param interval: seconds to wait between polls
+        :param on_update: optional callback receiving the dict returned by run_once whenever something changed
+        """
+        try:
+            while True:
+                evaluated = self.run_once()
+                if evaluated and on_update is not None:
+                    on_update(evaluated)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    def _refresh(self, watched: WatchedFile) -> int:
+        """
+        diffs the lines of a file against the hashes of the previous run, calculates only the new ones
+        and rewrites the sidecar
+        :param watched: file to refresh
+        :return: amount of lines that were calculated
+        """
+        with open(watched.path, encoding="utf-8") as file:
+            lines = file.read().splitlines()
+
+        hashes = [_line_hash(line) for line in lines]
+        results = {}
+        changed = {}
+
+        for line, line_hash in zip(lines, hashes):
+            if line_hash in results or line_hash in changed:
+                continue
+            if line_hash in watched.results:
+                results[line_hash] = watched.results[line_hash]
+            elif not line.strip():
+                results[line_hash] = ""
+            else:
+                changed[line_hash] = line
+
+        batch = self.calculator.calculate_batch(changed.values())
+        for line_hash, value, error in zip(changed, batch.values, batch.errors):
+            results[line_hash] = str(error) if error is not None else format_result(value)
+
+        watched.results = results  # lines that disappeared from the file are dropped from the cache
+        self._write_output(watched.output_path, [results[line_hash] for line_hash in hashes])
+        return len(changed)
+
+    @staticmethod
+    def _write_output(output_path: str, output_lines: list[str]):
+        temporary_path = output_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(output_lines) + "\n" if output_lines else "")
+        os.replace(temporary_path, output_path)  # readers never see a half written sidecar